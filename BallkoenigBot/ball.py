@@ -1,42 +1,94 @@
 import telebot
 import json
 import os
+import queue
+import secrets
+import sys
 from telebot import types
-import sqlite3
-from time import sleep
+import threading
+import unicodedata
+from functools import lru_cache
+from time import monotonic, time
 
-BOT_TOKEN = os.getenv("BOT_KEY")
-bot = telebot.TeleBot(BOT_TOKEN)
+# Dateien liegen neben dem Skript, unabhängig vom Arbeitsverzeichnis
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Dictionary to store message IDs for each chat
-chat_message_ids = {}
+# botkern.py liegt im Container neben dem Skript, im Repository eine Ebene darüber
+sys.path.append(os.path.dirname(BASE_DIR))
+import botkern
+
+# Einstellungen kommen aus Umgebungsvariablen; BALLKOENIG_<NAME> hat Vorrang vor <NAME>,
+# damit beide Bots im gemeinsamen Host (host.py) eigene Werte bekommen
+setting = botkern.settings('BALLKOENIG')
+
+
+# Metriken: Zähler, Latenz-Histogramme und Warteschlangenlängen. Abrufbar im Prometheus-
+# Textformat unter http://<host>:METRICS_PORT/metrics, zusätzlich regelmäßig als
+# Zusammenfassung im Log. Port bzw. Intervall 0 schaltet das jeweils ab. Der Endpunkt lauscht
+# nur lokal; METRICS_HOST=0.0.0.0 macht ihn von außen erreichbar (z.B. für Prometheus in
+# einem anderen Container).
+METRICS_PORT = int(setting('METRICS_PORT', '9102'))
+METRICS_HOST = setting('METRICS_HOST', '127.0.0.1')
+METRICS_LOG_INTERVAL = int(setting('METRICS_LOG_INTERVAL', '300'))
+HISTOGRAM_LABELS = {'db_seconds': 'operation', 'api_seconds': 'method', 'handler_seconds': 'handler',
+                    'backup_seconds': 'database'}
+
+metrics = botkern.Metrics('ballkoenig', HISTOGRAM_LABELS)
+count = metrics.count
+
+
+def start_metrics():
+    metrics.start(bot, METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL)
+
+
+# Updates verschiedener Chats werden parallel abgearbeitet, Updates desselben Chats bleiben
+# in Reihenfolge (siehe botkern.ChatWorkerPool)
+WORKER_THREADS = int(setting('WORKER_THREADS', '4'))
+WORKER_QUEUE_SIZE = int(setting('WORKER_QUEUE_SIZE', '1000'))
+
+BOT_TOKEN = setting("BOT_KEY")
+bot = botkern.ChatOrderedBot(BOT_TOKEN, botkern.ChatWorkerPool(WORKER_THREADS, WORKER_QUEUE_SIZE), metrics)
+metrics.gauges['worker_queue_depth'] = lambda: bot.pool.depth()
 
 
 def clear_chat_messages(chat_id):
-    if chat_id in chat_message_ids:
-        for message_id in chat_message_ids[chat_id]:
-            try:
-                bot.delete_message(chat_id, message_id)
-            except telebot.apihelper.ApiException as e:
-                if e.error_code != 400:  # Ignore "Bad Request"
-                    print(f"Error deleting message {message_id}: {e}")
-        del chat_message_ids[chat_id]
+    for message_id in conversations.take_messages(chat_id):
+        try:
+            bot.delete_message(chat_id, message_id)
+        except telebot.apihelper.ApiException as e:
+            if e.error_code != 400:  # Ignore "Bad Request"
+                print(f"Error deleting message {message_id}: {e}")
 
 
-def db_operation(func, *args):
-    conn = sqlite3.connect('ballkoenig.db')
-    cursor = conn.cursor()
-    try:
-        result = func(cursor, *args)
-        conn.commit()
-        return result
-    except Exception as e:
-        print(f"Database error: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+# Verzögerte Aktionen (z.B. Nachrichten löschen) laufen in einem Hintergrund-Thread,
+# damit die Handler nicht mit sleep() den Polling-Thread blockieren.
+DELETE_DELAY_MS = 1000
+ACTION_RETRIES = 3
+
+scheduler = botkern.Scheduler('ballkoenig-scheduler', DELETE_DELAY_MS, ACTION_RETRIES)
+schedule_action = scheduler.schedule
+metrics.gauges['scheduled_actions'] = lambda: len(scheduler.actions)
+
+
+def schedule_delete(chat_id, message_id, delay_ms=DELETE_DELAY_MS):
+    schedule_action(delay_ms, bot.delete_message, chat_id, message_id)
+
+
+# Alle Telegram-Aufrufe laufen über send_request: globales Rate-Limit, Limit pro Chat
+# für send*-Methoden und Warten laut retry_after, wenn Telegram mit 429 antwortet.
+GLOBAL_RATE_LIMIT = 25  # Aufrufe pro Sekunde über alle Chats
+CHAT_RATE_LIMIT = 1     # Nachrichten pro Sekunde und Chat
+CHAT_BURST = 3
+API_RETRIES = 3
+
+send_request = botkern.RequestSender(metrics, GLOBAL_RATE_LIMIT, CHAT_RATE_LIMIT, CHAT_BURST, API_RETRIES)
+telebot.apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+
+DB_FILE = setting('DB_FILE', os.path.join(BASE_DIR, 'ballkoenig.db'))
+
+database = botkern.Database(DB_FILE, metrics)
+db_operation = database.run
 
 
 def create_table(cursor):
@@ -56,39 +108,376 @@ def insert_kandidaten(cursor, kandidaten):
         ''', (kandidat['name'], kandidat['geschlecht']))
 
 
-def update_punkte(cursor, name, punkte):
+def get_all_punkte(cursor):
+    cursor.execute('''
+        SELECT name, geschlecht, punkte FROM kandidaten
+    ''')
+    return cursor.fetchall()
+
+
+def create_donations_table(cursor):
+    # Tabelle und Übertrag in einer Transaktion wie die Migrationen im Nachschub-Bot: ohne
+    # BEGIN IMMEDIATE würde das CREATE sofort committet, und ein Fehler beim INSERT hinterließe
+    # ein leeres Ledger, aus dem rebuild_punkte alle Punkte auf 0 setzt. Gibt True zurück, wenn
+    # das Ledger steht (bei einem Fehler liefert db_operation None).
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'donations'")
+    if cursor.fetchone():
+        return True
     cursor.execute('''
+        CREATE TABLE donations (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            betrag INTEGER,
+            punkte INTEGER NOT NULL,
+            anzahl INTEGER NOT NULL,
+            chat_id INTEGER,
+            at REAL NOT NULL
+        )
+    ''')
+    # Bisherige Punktestände als Übertrag, damit sich alle Summen aus dem Ledger ergeben
+    cursor.execute('''
+        INSERT INTO donations (name, betrag, punkte, anzahl, chat_id, at)
+        SELECT name, NULL, punkte, 1, NULL, ? FROM kandidaten WHERE punkte > 0
+    ''', (time(),))
+    return True
+
+
+def insert_donations(cursor, donations):
+    cursor.executemany('''
+        INSERT INTO donations (name, betrag, punkte, anzahl, chat_id, at) VALUES (?, ?, ?, ?, ?, ?)
+    ''', donations)
+    totals = {}
+    for name, _, punkte, anzahl, _, _ in donations:
+        totals[name] = totals.get(name, 0) + punkte * anzahl
+    cursor.executemany('''
         UPDATE kandidaten SET punkte = punkte + ? WHERE name = ?
-    ''', (punkte, name))
+    ''', [(punkte, name) for name, punkte in totals.items()])
+    return len(donations)
 
 
-def get_top_kandidaten(cursor, geschlecht, limit=5):
+def get_donation_totals(cursor):
     cursor.execute('''
-        SELECT name, punkte FROM kandidaten WHERE geschlecht = ? ORDER BY punkte DESC LIMIT ?
-    ''', (geschlecht, limit))
+        SELECT name, SUM(punkte * anzahl) FROM donations GROUP BY name
+    ''')
     return cursor.fetchall()
 
 
-# JSON-Datei laden and database initialization
-try:
-    with open('kandidaten.json', 'r', encoding='utf-8') as f:
+def rebuild_punkte(cursor):
+    # Die Punktestände sind nur eine Summe über das Ledger und werden daraus neu berechnet
+    cursor.execute('''
+        UPDATE kandidaten SET punkte = COALESCE(
+            (SELECT SUM(donations.punkte * donations.anzahl) FROM donations WHERE donations.name = kandidaten.name), 0)
+    ''')
+
+
+# Sicherungen: alle BACKUP_INTERVAL Sekunden ein Schnappschuss von ballkoenig.db über die
+# Online-Backup-API von SQLite, in Schritten zu BACKUP_PAGES Seiten mit kurzer Pause dazwischen.
+# Die Quellverbindung hält währenddessen eine Lesetransaktion offen: im WAL-Modus blockiert das
+# keine Schreiber, und die Kopie muss nicht nach jeder neuen Spende von vorn beginnen.
+# Neben jedem Schnappschuss liegt ein Export der Punktestände (BACKUP_EXPORT: csv oder jsonl).
+# Fehlt ballkoenig.db beim Start, wird der neueste Schnappschuss zurückgespielt; BACKUP_RESTORE
+# (Pfad oder 'latest') erzwingt das auch bei vorhandener Datenbank.
+BACKUP_DIR = setting('BACKUP_DIR', os.path.join(BASE_DIR, 'backups'))
+BACKUP_INTERVAL = int(setting('BACKUP_INTERVAL', '300'))  # Sekunden, 0 = aus
+BACKUP_PAGES = int(setting('BACKUP_PAGES', '64'))
+BACKUP_PAUSE_MS = int(setting('BACKUP_PAUSE_MS', '5'))
+BACKUP_KEEP = int(setting('BACKUP_KEEP', '12'))  # 0 = alle behalten
+BACKUP_EXPORT = setting('BACKUP_EXPORT', 'csv')
+BACKUP_RESTORE = setting('BACKUP_RESTORE', '')
+
+backups = botkern.Backups(DB_FILE, BACKUP_DIR, 'ballkoenig-',
+                          'SELECT name, geschlecht, punkte FROM kandidaten ORDER BY punkte DESC, name', metrics,
+                          BACKUP_INTERVAL, BACKUP_PAGES, BACKUP_PAUSE_MS, BACKUP_KEEP, BACKUP_EXPORT, BACKUP_RESTORE)
+
+
+# Spenden-Ledger mit Group Commit: Handler legen Spenden in eine Warteschlange und warten auf
+# den Commit. Ein Hintergrund-Thread schreibt alles, was sich während des vorigen Commits
+# angesammelt hat, samt Punkte-Updates in einer Transaktion. Mit DONATION_BATCH_MS > 0 wartet
+# er zusätzlich so lange auf weitere Spenden (größere Batches, aber mehr Latenz).
+DONATION_BATCH_MS = int(setting('DONATION_BATCH_MS', '0'))
+DONATION_BATCH_SIZE = 500
+DONATION_TIMEOUT = 10  # Sekunden, die ein Handler höchstens auf den Commit wartet
+
+
+class PendingDonation:
+    __slots__ = ('row', 'done', 'ok', 'state')
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.ok = False
+        self.state = 'wartend'  # 'wartend', 'schreibend' oder 'verworfen'
+
+
+donation_queue = queue.Queue()
+donation_state_lock = threading.Lock()  # schützt PendingDonation.state
+donation_writer_lock = threading.Lock()
+donation_writer_started = False
+metrics.gauges['donation_queue_depth'] = donation_queue.qsize
+
+
+def record_donation(name, betrag, punkte, anzahl, chat_id):
+    """Schreibt eine Spende ins Ledger und wartet auf den Commit. True bei Erfolg."""
+    start_donation_writer()
+    donation = PendingDonation((name, betrag, punkte, anzahl, chat_id, time()))
+    donation_queue.put(donation)
+    if not donation.done.wait(DONATION_TIMEOUT):
+        with donation_state_lock:
+            if donation.state == 'wartend':
+                # Der Writer überspringt die Spende; sie darf erneut eingegeben werden
+                donation.state = 'verworfen'
+                count('donations_abandoned')
+                return False
+        # Der Writer schreibt sie bereits: auf das Ergebnis warten, sonst würde sie doppelt gebucht
+        donation.done.wait()
+    return donation.ok
+
+
+def run_donation_writer():
+    while True:
+        batch = [donation_queue.get()]
+        deadline = monotonic() + DONATION_BATCH_MS / 1000
+        while len(batch) < DONATION_BATCH_SIZE:
+            try:
+                batch.append(donation_queue.get(timeout=max(0, deadline - monotonic())))
+            except queue.Empty:
+                break
+        with donation_state_lock:
+            batch = [donation for donation in batch if donation.state == 'wartend']
+            for donation in batch:
+                donation.state = 'schreibend'
+        if not batch:
+            continue
+        ok = db_operation(insert_donations, [donation.row for donation in batch]) is not None
+        count('donation_batches')
+        for donation in batch:
+            donation.ok = ok
+            donation.done.set()
+
+
+def start_donation_writer():
+    global donation_writer_started
+    with donation_writer_lock:
+        if not donation_writer_started:
+            threading.Thread(target=run_donation_writer, name='donation-writer', daemon=True).start()
+            donation_writer_started = True
+
+
+# Gesprächszustand pro Chat: aktueller Schritt im Spenden-Ablauf und Nachrichten, die beim
+# nächsten Schritt gelöscht werden
+CONVERSATION_TTL = int(setting('CONVERSATION_TTL', '1800'))  # Sekunden
+MAX_CONVERSATIONS = int(setting('MAX_CONVERSATIONS', '10000'))
+
+conversations = botkern.ConversationStore(database, CONVERSATION_TTL, MAX_CONVERSATIONS)
+
+
+# Rangliste im Speicher: die Punkte werden weiterhin in SQLite gespeichert, die Top-N
+# pro Geschlecht aber bei jeder Spende nachgeführt statt bei jeder Anzeige abgefragt.
+LEADERBOARD_SIZE = int(setting('LEADERBOARD_SIZE', '5'))
+TOP_BUTTON = f"Top {LEADERBOARD_SIZE} anzeigen"
+
+
+class Leaderboard:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.punkte = {}
+        self.geschlecht = {}
+        self.top = {}  # geschlecht -> [(name, punkte), ...] absteigend sortiert
+        self.text = None
+
+    def load(self, rows):
+        with self.lock:
+            self.punkte = {name: punkte or 0 for name, _, punkte in rows}
+            self.geschlecht = {name: geschlecht for name, geschlecht, _ in rows}
+            self.top = {geschlecht: self._ranking(geschlecht) for geschlecht in set(self.geschlecht.values())}
+            self.text = None
+
+    def _ranking(self, geschlecht):
+        entries = [(name, punkte) for name, punkte in self.punkte.items() if self.geschlecht[name] == geschlecht]
+        entries.sort(key=lambda entry: (-entry[1], entry[0]))
+        return entries[:self.size]
+
+    def add(self, name, punkte):
+        """Bucht Punkte für einen Kandidaten und gibt zurück, ob sich die Top-N geändert haben."""
+        with self.lock:
+            if name not in self.punkte:
+                return False
+            self.punkte[name] += punkte
+            geschlecht = self.geschlecht[name]
+            old_top = self.top.get(geschlecht, [])
+            if punkte < 0:
+                new_top = self._ranking(geschlecht)
+            else:
+                # Punkte steigen nur: nur der gebuchte Kandidat kann seinen Platz verändern
+                new_top = [entry for entry in old_top if entry[0] != name] + [(name, self.punkte[name])]
+                new_top.sort(key=lambda entry: (-entry[1], entry[0]))
+                new_top = new_top[:self.size]
+            if new_top == old_top:
+                return False
+            self.top[geschlecht] = new_top
+            self.text = None
+            return True
+
+    def render(self):
+        with self.lock:
+            if self.text is None:
+                koenig_liste = "\n".join([f"{name}: {punkte}" for name, punkte in self.top.get('M', [])])
+                koenigin_liste = "\n".join([f"{name}: {punkte}" for name, punkte in self.top.get('W', [])])
+                self.text = (f"Top {self.size} Ballkönige:\n{koenig_liste}\n\n"
+                             f"Top {self.size} Ballköniginnen:\n{koenigin_liste}")
+            return self.text
+
+
+leaderboard = Leaderboard(LEADERBOARD_SIZE)
+
+
+# Live-Rangliste: abonnierte Chats bekommen eine Nachricht, die bei Änderungen der Top-N
+# bearbeitet wird, höchstens einmal pro LIVE_UPDATE_INTERVAL_MS.
+LIVE_UPDATE_INTERVAL_MS = int(setting('LIVE_UPDATE_INTERVAL_MS', '5000'))
+LIVE_SUBSCRIBE_BUTTON = "Live-Rangliste abonnieren"
+LIVE_UNSUBSCRIBE_BUTTON = "Live-Rangliste beenden"
+
+live_subscribers = {}  # chat_id -> (message_id, zuletzt angezeigter Text)
+metrics.gauges['live_subscribers'] = lambda: len(live_subscribers)
+live_lock = threading.Lock()
+live_update_pending = False
+
+
+def leaderboard_changed():
+    global live_update_pending
+    with live_lock:
+        if live_update_pending or not live_subscribers:
+            return
+        live_update_pending = True
+    schedule_action(LIVE_UPDATE_INTERVAL_MS, broadcast_leaderboard)
+
+
+def broadcast_leaderboard():
+    global live_update_pending
+    with live_lock:
+        live_update_pending = False
+        subscribers = list(live_subscribers.items())
+
+    text = leaderboard.render()
+    for chat_id, (message_id, last_text) in subscribers:
+        if last_text == text:
+            continue
+        try:
+            bot.edit_message_text(text, chat_id, message_id)
+        except Exception as e:
+            # 400 = Nachricht gelöscht oder nicht mehr bearbeitbar: Abo beenden
+            if getattr(e, 'error_code', None) == 400:
+                with live_lock:
+                    live_subscribers.pop(chat_id, None)
+            else:
+                print(f"Error updating live leaderboard in {chat_id}: {e}")
+            continue
+        with live_lock:
+            if chat_id in live_subscribers:
+                live_subscribers[chat_id] = (message_id, text)
+
+
+KANDIDATEN_FILE = os.path.join(BASE_DIR, 'kandidaten.json')
+kandidaten_data = []
+
+
+def normalize_name(text, expand_umlauts=False):
+    # Groß-/Kleinschreibung und Akzente ignorieren, wahlweise ä -> ae usw.
+    text = text.casefold()
+    if expand_umlauts:
+        for umlaut, replacement in (('ä', 'ae'), ('ö', 'oe'), ('ü', 'ue')):
+            text = text.replace(umlaut, replacement)
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+class KandidatenIndex:
+    """Suchindex über die Kandidatennamen, wird einmal beim Laden gebaut.
+
+    Jeder Name wird in zwei normalisierten Schreibweisen ("muller" und "mueller")
+    abgelegt; Teilstring-Suchen laufen über einen Trigramm-Index, exakte Namen
+    werden über ein Set geprüft.
+    """
+    GRAM = 3
+
+    def __init__(self, kandidaten):
+        self.names = [kandidat['name'] for kandidat in kandidaten]
+        self.exact = set(self.names)
+        self.forms = []
+        self.grams = {}
+        for number, name in enumerate(self.names):
+            forms = {normalize_name(name), normalize_name(name, expand_umlauts=True)}
+            self.forms.append(forms)
+            for form in forms:
+                for i in range(len(form) - self.GRAM + 1):
+                    self.grams.setdefault(form[i:i + self.GRAM], set()).add(number)
+
+    def __contains__(self, name):
+        return name in self.exact
+
+    def search(self, query):
+        query = normalize_name(query)
+        if len(query) >= self.GRAM:
+            postings = []
+            for i in range(len(query) - self.GRAM + 1):
+                gram_postings = self.grams.get(query[i:i + self.GRAM])
+                if not gram_postings:
+                    return []
+                postings.append(gram_postings)
+            postings.sort(key=len)
+            numbers = sorted(set(postings[0]).intersection(*postings[1:]))
+        else:
+            numbers = range(len(self.names))
+        return [self.names[number] for number in numbers if any(query in form for form in self.forms[number])]
+
+
+kandidaten_index = KandidatenIndex([])
+
+
+def load_kandidaten():
+    global kandidaten_data, kandidaten_index
+    with open(KANDIDATEN_FILE, 'r', encoding='utf-8') as f:
         kandidaten_data = json.load(f)
-        db_operation(create_table)
-        db_operation(insert_kandidaten, kandidaten_data)
-except FileNotFoundError:
-    print("kandidaten.json nicht gefunden. Bitte erstellen Sie die Datei.")
-    exit()
+    kandidaten_index = KandidatenIndex(kandidaten_data)
+    kandidaten_keyboard.cache_clear()
+    return kandidaten_data
+
+
+# Gerenderte Kandidaten-Tastaturen (als JSON) pro Suchbegriff, werden bei load_kandidaten verworfen
+@lru_cache(maxsize=256)
+def kandidaten_keyboard(query):
+    matching_kandidaten = kandidaten_index.search(query)
+    if not matching_kandidaten:
+        return None
+
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
+    for name in matching_kandidaten:
+        markup.add(types.KeyboardButton(name))
+    markup.add(types.KeyboardButton("Abbrechen"))
+    return markup.to_json()
+
 
 
 @bot.message_handler(commands=['start'])
 def start(message):
+    conversations.take_step(message.chat.id)
     clear_chat_messages(message.chat.id)
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     item1 = types.KeyboardButton("Spende hinzufügen")
-    item2 = types.KeyboardButton("Top 5 anzeigen")
+    item2 = types.KeyboardButton(TOP_BUTTON)
     markup.add(item1, item2)
     msg = bot.send_message(message.chat.id, 'Hauptmenü:', reply_markup=markup)
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
+    conversations.add_message(message.chat.id, msg.message_id)
+
+
+# Wartet ein Chat auf eine Eingabe im Spenden-Ablauf, geht die Nachricht an diesen Schritt
+@bot.message_handler(func=lambda message: conversations.step(message.chat.id) is not None)
+def naechster_schritt(message):
+    step, args = conversations.take_step(message.chat.id)
+    if step in STEPS:
+        STEPS[step](message, *args)
 
 
 @bot.message_handler(func=lambda message: message.text == "Spende hinzufügen")
@@ -100,8 +489,8 @@ def spende_hinzufuegen(message):
     item3 = types.KeyboardButton("Abbrechen")
     markup.add(item1, item2, item3)
     msg = bot.send_message(message.chat.id, 'Wähle den Spendenbetrag:', reply_markup=markup)
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-    bot.register_next_step_handler(message, spendenbetrag_auswahl)
+    conversations.add_message(message.chat.id, msg.message_id)
+    conversations.set_step(message.chat.id, 'spendenbetrag_auswahl')
 
 
 def spendenbetrag_auswahl(message):
@@ -115,14 +504,13 @@ def spendenbetrag_auswahl(message):
 
     if betrag is None:
         msg = bot.send_message(message.chat.id, "Ungültige Auswahl. Bitte wählen Sie einen gültigen Spendenbetrag.")
-        chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-        sleep(1)
+        schedule_delete(message.chat.id, msg.message_id)
         spende_hinzufuegen(message)
         return
 
     msg = bot.send_message(message.chat.id, "Wie oft wurde dieser Betrag gespendet? (Bitte Zahl eingeben)", reply_markup=types.ReplyKeyboardRemove())
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-    bot.register_next_step_handler(msg, anzahl_spenden, betrag, punkte)
+    conversations.add_message(message.chat.id, msg.message_id)
+    conversations.set_step(message.chat.id, 'anzahl_spenden', betrag, punkte)
 
 
 def anzahl_spenden(message, betrag, punkte):
@@ -136,80 +524,98 @@ def anzahl_spenden(message, betrag, punkte):
             start(message)
             return
         msg = bot.send_message(message.chat.id, "Ungültige Anzahl. Bitte geben Sie eine positive ganze Zahl ein.")
-        chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
+        conversations.add_message(message.chat.id, msg.message_id)
         msg = bot.send_message(message.chat.id, "Wie oft wurde dieser Betrag gespendet?")
-        chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-        bot.register_next_step_handler(msg, anzahl_spenden, betrag, punkte)
+        conversations.add_message(message.chat.id, msg.message_id)
+        conversations.set_step(message.chat.id, 'anzahl_spenden', betrag, punkte)
         return
 
-    with open('kandidaten.json', 'r', encoding='utf-8') as f:
-        kandidaten = json.load(f)
-
     msg = bot.send_message(message.chat.id, "Geben Sie den Namen des Kandidaten ein (oder einen Teil davon):", reply_markup=types.ReplyKeyboardRemove())
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-    bot.register_next_step_handler(msg, kandidat_auswahl, anzahl, punkte, kandidaten)
+    conversations.add_message(message.chat.id, msg.message_id)
+    conversations.set_step(message.chat.id, 'kandidat_auswahl', anzahl, punkte, betrag)
 
 
-def kandidat_auswahl(message, anzahl, punkte, kandidaten):
+def kandidat_auswahl(message, anzahl, punkte, betrag=None):
     clear_chat_messages(message.chat.id)
     if message.text == "Abbrechen":
         start(message)
         return
 
-    entered_name = message.text.lower()
-    matching_kandidaten = [kandidat for kandidat in kandidaten if entered_name in kandidat['name'].lower()]
+    markup = kandidaten_keyboard(normalize_name(message.text))
 
-    if not matching_kandidaten:
+    if markup is None:
         msg = bot.send_message(message.chat.id, "Kein Kandidat gefunden. Bitte versuchen Sie es erneut.", reply_markup=types.ReplyKeyboardRemove())
-        chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-        bot.register_next_step_handler(msg, kandidat_auswahl, anzahl, punkte, kandidaten)
+        conversations.add_message(message.chat.id, msg.message_id)
+        conversations.set_step(message.chat.id, 'kandidat_auswahl', anzahl, punkte, betrag)
         return
 
-
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1)
-    for kandidat in matching_kandidaten:
-        markup.add(types.KeyboardButton(kandidat['name']))
-    markup.add(types.KeyboardButton("Abbrechen"))
-
     msg = bot.send_message(message.chat.id, "Wählen Sie den Kandidaten oder geben Sie den Namen des Kandidaten ein (oder einen Teil davon):", reply_markup=markup)
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-    bot.register_next_step_handler(msg, kandidat_auswahl_from_list, anzahl, punkte)
+    conversations.add_message(message.chat.id, msg.message_id)
+    conversations.set_step(message.chat.id, 'kandidat_auswahl_from_list', anzahl, punkte, betrag)
 
 
 
-def kandidat_auswahl_from_list(message, anzahl, punkte): # Handler for list selection
+def kandidat_auswahl_from_list(message, anzahl, punkte, betrag=None): # Handler for list selection
     clear_chat_messages(message.chat.id)
     if message.text == "Abbrechen":
         start(message)
         return
 
     name = message.text
-    with open('kandidaten.json', 'r', encoding='utf-8') as f:
-        kandidaten = json.load(f)
+    if name not in kandidaten_index:
+        kandidat_auswahl(message, anzahl, punkte, betrag)
+        return
 
-    if not any(kandidat['name'] == name for kandidat in kandidaten):
-        kandidat_auswahl(message, anzahl, punkte, kandidaten)
+    if not record_donation(name, betrag, punkte, anzahl, message.chat.id):
+        msg = bot.send_message(message.chat.id, "Die Spende konnte nicht gespeichert werden. Bitte erneut eingeben.", reply_markup=types.ReplyKeyboardRemove())
+        schedule_delete(message.chat.id, msg.message_id)
+        start(message)
         return
 
-    db_operation(update_punkte, name, anzahl * punkte)
+    count('donations', anzahl)
+    count('donation_points', anzahl * punkte)
+    if leaderboard.add(name, anzahl * punkte):
+        leaderboard_changed()
     msg = bot.send_message(message.chat.id, f"Spende für {name} erfolgreich hinzugefügt!", reply_markup=types.ReplyKeyboardRemove())
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
-    sleep(1)
+    schedule_delete(message.chat.id, msg.message_id)
     start(message)
 
 
 
-@bot.message_handler(func=lambda message: message.text == "Top 5 anzeigen")
+@bot.message_handler(func=lambda message: message.text == TOP_BUTTON)
 def top_5_anzeigen(message):
     clear_chat_messages(message.chat.id)
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    markup.add(types.KeyboardButton("Zurück"))
+    if message.chat.id in live_subscribers:
+        markup.add(types.KeyboardButton("Zurück"), types.KeyboardButton(LIVE_UNSUBSCRIBE_BUTTON))
+    else:
+        markup.add(types.KeyboardButton("Zurück"), types.KeyboardButton(LIVE_SUBSCRIBE_BUTTON))
 
-    koenig_liste = "\n".join([f"{name}: {punkte}" for name, punkte in db_operation(get_top_kandidaten, 'M')])
-    koenigin_liste = "\n".join([f"{name}: {punkte}" for name, punkte in db_operation(get_top_kandidaten, 'W')])
+    msg = bot.send_message(message.chat.id, leaderboard.render(), reply_markup=markup)
+    conversations.add_message(message.chat.id, msg.message_id)
 
-    msg = bot.send_message(message.chat.id, f"Top 5 Ballkönige:\n{koenig_liste}\n\nTop 5 Ballköniginnen:\n{koenigin_liste}", reply_markup=markup)
-    chat_message_ids.setdefault(message.chat.id, []).append(msg.message_id)
+
+@bot.message_handler(func=lambda message: message.text == LIVE_SUBSCRIBE_BUTTON)
+def live_abonnieren(message):
+    clear_chat_messages(message.chat.id)
+    # Die Live-Nachricht wird nicht in conversations gemerkt, damit sie stehen bleibt
+    text = leaderboard.render()
+    msg = bot.send_message(message.chat.id, text)
+    with live_lock:
+        previous = live_subscribers.get(message.chat.id)
+        live_subscribers[message.chat.id] = (msg.message_id, text)
+    if previous:
+        schedule_delete(message.chat.id, previous[0], 0)
+    start(message)
+
+
+@bot.message_handler(func=lambda message: message.text == LIVE_UNSUBSCRIBE_BUTTON)
+def live_beenden(message):
+    with live_lock:
+        subscription = live_subscribers.pop(message.chat.id, None)
+    if subscription:
+        schedule_delete(message.chat.id, subscription[0], 0)
+    start(message)
 
 
 @bot.message_handler(func=lambda message: message.text == "Zurück")
@@ -217,6 +623,63 @@ def zurueck(message):
     start(message)
 
 
+STEPS = {
+    'spendenbetrag_auswahl': spendenbetrag_auswahl,
+    'anzahl_spenden': anzahl_spenden,
+    'kandidat_auswahl': kandidat_auswahl,
+    'kandidat_auswahl_from_list': kandidat_auswahl_from_list,
+}
+
+
+# Webhook-Betrieb: ist WEBHOOK_URL gesetzt, schickt Telegram die Updates per HTTPS an diese
+# Adresse statt dass der Bot sie per Long Polling abholt. Der lokale Server prüft das
+# Secret-Token und reicht die Updates an die Chat-Worker weiter.
+WEBHOOK_URL = setting('WEBHOOK_URL', '')
+WEBHOOK_PORT = int(setting('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = setting('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+
+# Start in drei Schritten, damit host.py das Modul importieren kann, ohne dass dabei
+# schon die Datenbank angefasst oder gepollt wird
+def setup():
+    backups.restore()
+    # JSON-Datei laden and database initialization
+    try:
+        load_kandidaten()
+    except FileNotFoundError:
+        raise botkern.SetupError('kandidaten.json nicht gefunden. Bitte erstellen Sie die Datei.')
+    db_operation(create_table)
+    db_operation(insert_kandidaten, kandidaten_data)
+    # Punkte nur aus einem vollständigen Ledger neu berechnen
+    if db_operation(create_donations_table):
+        db_operation(rebuild_punkte)
+    else:
+        print('Spenden-Ledger konnte nicht angelegt werden, Punktestände bleiben unverändert.')
+    db_operation(botkern.create_conversations_table)
+    conversations.load()
+    leaderboard.load(db_operation(get_all_punkte) or [])
+
+
+def start_services():
+    scheduler.start()
+    start_donation_writer()
+    start_metrics()
+    backups.start()
+
+
+def run():
+    if WEBHOOK_URL:
+        botkern.run_webhook(bot, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_PORT)
+    else:
+        bot.remove_webhook()
+        bot.polling(none_stop=True)
+
+
 if __name__ == "__main__":
     print("Ballkönig Bot läuft...")
-    bot.polling(none_stop=True)
\ No newline at end of file
+    try:
+        setup()
+    except botkern.SetupError as e:
+        sys.exit(str(e))
+    start_services()
+    run()
@@ -1,11 +1,29 @@
+import itertools
 import json
 import os
-import sqlite3
-from telebot import TeleBot, types
-from time import sleep
+import re
+import secrets
+import sys
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime
+from telebot import apihelper, types
+from time import monotonic, time
+
+# Dateien liegen neben dem Skript, unabhängig vom Arbeitsverzeichnis
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# botkern.py liegt im Container neben dem Skript, im Repository eine Ebene darüber
+sys.path.append(os.path.dirname(BASE_DIR))
+import botkern
+
+# Einstellungen kommen aus Umgebungsvariablen; NACHSCHUB_<NAME> hat Vorrang vor <NAME>,
+# damit beide Bots im gemeinsamen Host (host.py) eigene Werte bekommen
+setting = botkern.settings("NACHSCHUB")
 
 # Konfigurationsdatei laden
-CONFIG_FILE = "config.json"
+CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
 with open(CONFIG_FILE, "r") as file:
     config = json.load(file)
 
@@ -22,25 +40,209 @@ for bar in BARS.values():
             raise ValueError(f"Bar '{bar}' in der Konfigurationsdatei hat ein nicht zugeordnetes Getränk: {drink}")
 
 
+# Kurze Schlüssel für Callback-Daten (Telegram erlaubt höchstens 64 Bytes)
+BAR_INDEX = {bar_name: index for index, bar_name in enumerate(BARS)}
+BAR_NAMES = list(BARS)
+DRINK_INDEX = {drink: index for index, drink in enumerate(DRINKS)}
+
+
+# Die Getränkemenüs sind statisch und werden einmal pro Bar als JSON-Tastatur gebaut
+DRINK_MENUS = {}
+
+def build_drink_menus():
+    DRINK_MENUS.clear()
+    for bar_name, assigned_drinks in BARS.items():
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        for drink in assigned_drinks:
+            markup.add(types.InlineKeyboardButton(drink, callback_data=f"order:{drink}"))
+        if assigned_drinks:
+            markup.row(types.InlineKeyboardButton("🛒 Mehrere Getränke bestellen", callback_data="cart:open"))
+        DRINK_MENUS[bar_name] = markup.to_json()
+
+build_drink_menus()
+
+
+# Metriken: Zähler, Latenz-Histogramme und Warteschlangenlängen. Abrufbar im Prometheus-
+# Textformat unter http://<host>:METRICS_PORT/metrics, zusätzlich regelmäßig als
+# Zusammenfassung im Log. Port bzw. Intervall 0 schaltet das jeweils ab. Der Endpunkt lauscht
+# nur lokal; METRICS_HOST=0.0.0.0 macht ihn von außen erreichbar (z.B. für Prometheus in
+# einem anderen Container).
+METRICS_PORT = int(setting("METRICS_PORT", "9101"))
+METRICS_HOST = setting("METRICS_HOST", "127.0.0.1")
+METRICS_LOG_INTERVAL = int(setting("METRICS_LOG_INTERVAL", "300"))
+HISTOGRAM_LABELS = {"db_seconds": "operation", "api_seconds": "method", "handler_seconds": "handler",
+                    "outbound_wait_seconds": "job", "backup_seconds": "database"}
+
+metrics = botkern.Metrics("nachschub", HISTOGRAM_LABELS)
+count = metrics.count
+observe = metrics.observe
+
+def start_metrics():
+    metrics.start(bot, METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL)
+
+
+# Updates verschiedener Chats werden parallel abgearbeitet, Updates desselben Chats
+# bleiben in Reihenfolge (siehe botkern.ChatWorkerPool)
+WORKER_THREADS = int(setting("WORKER_THREADS", "8"))
+WORKER_QUEUE_SIZE = int(setting("WORKER_QUEUE_SIZE", "1000"))
+
 # Initialisiere den Bot
-TOKEN = os.getenv("BOT_KEY")
-bot = TeleBot(TOKEN)
+TOKEN = setting("BOT_KEY")
+bot = botkern.ChatOrderedBot(TOKEN, botkern.ChatWorkerPool(WORKER_THREADS, WORKER_QUEUE_SIZE), metrics)
+metrics.gauges["worker_queue_depth"] = lambda: bot.pool.depth()
+
+
+# Verzögerte Aktionen (z.B. Nachrichten löschen) laufen in einem Hintergrund-Thread,
+# damit die Handler nicht mit sleep() den Polling-Thread blockieren.
+DELETE_DELAY_MS = 1000
+ACTION_RETRIES = 3
+
+scheduler = botkern.Scheduler("nachschub-scheduler", DELETE_DELAY_MS, ACTION_RETRIES)
+schedule_action = scheduler.schedule
+metrics.gauges["scheduled_actions"] = lambda: len(scheduler.actions)
+
+def schedule_delete(chat_id, message_id, delay_ms=DELETE_DELAY_MS):
+    schedule_action(delay_ms, bot.delete_message, chat_id, message_id)
+
+
+# Alle Telegram-Aufrufe laufen über send_request: globales Rate-Limit, Limit pro Chat
+# für send*-Methoden und Warten laut retry_after, wenn Telegram mit 429 antwortet.
+GLOBAL_RATE_LIMIT = 25  # Aufrufe pro Sekunde über alle Chats
+CHAT_RATE_LIMIT = 1     # Nachrichten pro Sekunde und Chat
+CHAT_BURST = 3
+API_RETRIES = 3
+
+send_request = botkern.RequestSender(metrics, GLOBAL_RATE_LIMIT, CHAT_RATE_LIMIT, CHAT_BURST, API_RETRIES)
+apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+
+# Ausgehende Warteschlange für Benachrichtigungen an andere Chats. Aufträge mit gleichem
+# Schlüssel (z.B. das Neuzeichnen derselben Liste) werden zusammengefasst, solange sie
+# noch nicht ausgeführt wurden; Fehler betreffen nur den einzelnen Auftrag. Hat ein Chat
+# sein Limit ausgeschöpft, bleiben seine Aufträge liegen und die anderer Chats laufen weiter.
+outbound_jobs = OrderedDict()
+outbound_condition = threading.Condition()
+outbound_sequence = itertools.count()
+
+def enqueue_send(key, func, chat_id, *args):
+    with outbound_condition:
+        if key is None:
+            key = ("once", next(outbound_sequence))
+        if key in outbound_jobs:
+            count("outbound_coalesced")
+            outbound_jobs[key] = (outbound_jobs[key][0], func, chat_id, args)
+        else:
+            count("outbound_queued")
+            outbound_jobs[key] = (monotonic(), func, chat_id, args)
+        outbound_condition.notify()
+
+def next_outbound_job():
+    # Ältester Auftrag eines Chats, der gerade senden darf; sonst None und die Zeit, bis der
+    # erste Chat wieder darf (None bei leerer Warteschlange). Pro Chat bleibt die Reihenfolge.
+    waits = {}
+    for key, (queued_at, func, chat_id, args) in outbound_jobs.items():
+        if chat_id not in waits:
+            waits[chat_id] = send_request.chat_bucket(chat_id).wait_time()
+        if not waits[chat_id]:
+            del outbound_jobs[key]
+            return (queued_at, func, chat_id, args), 0
+    return None, min(waits.values(), default=None)
+
+def outbound_queue_depth():
+    return len(outbound_jobs)
+
+metrics.gauges["outbound_queue_depth"] = outbound_queue_depth
+
+def run_sender():
+    while True:
+        with outbound_condition:
+            job, wait = next_outbound_job()
+            while job is None:
+                outbound_condition.wait(wait)
+                job, wait = next_outbound_job()
+        queued_at, func, chat_id, args = job
+        observe("outbound_wait_seconds", func.__name__, monotonic() - queued_at)
+        try:
+            func(chat_id, *args)
+            count("outbound_sent")
+        except Exception as e:
+            count("outbound_errors")
+            print(f"Outbound error: {e}")
+
+def start_sender():
+    threading.Thread(target=run_sender, name="sender", daemon=True).start()
+
+def send_temporary_message(chat_id, text):
+    msg = bot.send_message(chat_id, text)
+    schedule_delete(chat_id, msg.message_id)
+
+
+# Dashboard-Nachrichten (offene Bestellungen, Getränkemenü): pro Chat und Ansicht wird die
+# zuletzt gesendete Nachricht gemerkt. Im Live-Modus wird sie nur bearbeitet, wenn sich Text
+# oder Tastatur geändert haben, sonst wird sie wie bisher gelöscht und neu gesendet.
+LIVE_DASHBOARD = setting("LIVE_DASHBOARD", "1") == "1"
+
+dashboard_messages = {}  # (chat_id, view) -> (message_id, text, markup_json)
+dashboard_states = {}  # (chat_id, Ansicht) -> Zustand, aus dem sie zuletzt gebaut wurde
+dashboard_locks = {}
+
+def dashboard_unchanged(chat_id, view, state):
+    # Im Live-Modus muss eine Ansicht nicht neu gebaut werden, solange sich der Zustand,
+    # aus dem sie zuletzt gebaut wurde, nicht geändert hat
+    return LIVE_DASHBOARD and (chat_id, view) in dashboard_messages and dashboard_states.get((chat_id, view)) == state
+
+def render_dashboard(chat_id, view, text, markup, state=None):
+    # markup darf auch schon als JSON vorliegen (siehe DRINK_MENUS)
+    markup_json = markup if isinstance(markup, str) else markup.to_json()
+    lock = dashboard_locks.setdefault(chat_id, threading.Lock())
+    with lock:
+        current = dashboard_messages.get((chat_id, view))
+        if current and LIVE_DASHBOARD:
+            message_id, old_text, old_markup_json = current
+            if (old_text, old_markup_json) == (text, markup_json):
+                dashboard_states[(chat_id, view)] = state
+                return
+            try:
+                if old_text != text:
+                    bot.edit_message_text(text, chat_id, message_id, reply_markup=markup_json, parse_mode="Markdown")
+                else:
+                    bot.edit_message_reply_markup(chat_id, message_id, reply_markup=markup_json)
+                dashboard_messages[(chat_id, view)] = (message_id, text, markup_json)
+                dashboard_states[(chat_id, view)] = state
+                return
+            except Exception as e:
+                # Nachricht wurde gelöscht oder ist nicht mehr bearbeitbar: neu senden
+                print(f"Dashboard edit failed, resending: {e}")
+        elif current:
+            schedule_delete(chat_id, current[0], 0)
+
+        msg = bot.send_message(chat_id, text, reply_markup=markup_json, parse_mode="Markdown")
+        dashboard_messages[(chat_id, view)] = (msg.message_id, text, markup_json)
+        dashboard_states[(chat_id, view)] = state
+
+def dashboard_message_id(chat_id, view):
+    current = dashboard_messages.get((chat_id, view))
+    return current[0] if current else None
+
+def close_dashboard(chat_id, view):
+    dashboard_states.pop((chat_id, view), None)
+    current = dashboard_messages.pop((chat_id, view), None)
+    if current:
+        schedule_delete(chat_id, current[0], 0)
+
+def forget_dashboards(chat_id, delete=False):
+    for key in [key for key in dashboard_messages if key[0] == chat_id]:
+        dashboard_states.pop(key, None)
+        message_id = dashboard_messages.pop(key)[0]
+        if delete:
+            schedule_delete(chat_id, message_id, 0)
 
 # Helper functions for database interaction
-def db_operation(func, *args):
-    conn = sqlite3.connect('orders.db')
-    cursor = conn.cursor()
-    try:
-        result = func(cursor, *args)
-        conn.commit()
-        return result
-    except Exception as e:
-        print(f"Database error: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+DB_FILE = setting("DB_FILE", os.path.join(BASE_DIR, "orders.db"))
+
+database = botkern.Database(DB_FILE, metrics)
+db_operation = database.run
+on_commit = database.on_commit
 
 def create_orders_table(cursor):
     cursor.execute("""
@@ -65,9 +267,13 @@ def create_sessions_table(cursor):
 
 def save_session(cursor, chat_id, username, role):
     cursor.execute("REPLACE INTO sessions (chat_id, username, role) VALUES (?, ?, ?)", (chat_id, username, role))
+    on_commit(remember_session, chat_id, username, role)
+    return True
 
 def delete_session(cursor, chat_id):
     cursor.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+    on_commit(forget_session, chat_id)
+    return True
 
 def get_session(cursor, chat_id):
     cursor.execute("SELECT username, role FROM sessions WHERE chat_id = ?", (chat_id,))
@@ -77,28 +283,80 @@ def get_sessions_by_username(cursor, username):
     cursor.execute("SELECT chat_id FROM sessions WHERE username = ?", (username,))
     return cursor.fetchall()
 
-def insert_order(cursor, username, role, drink, quantity):
+# Ereignis-Log: jede neue und jede abgesendete Bestellung wird in derselben Transaktion
+# an order_events angehängt. Die Zeitstempel steigen streng monoton, auch wenn die
+# Systemuhr zurückspringt.
+event_clock_lock = threading.Lock()
+last_event_time = 0.0
+
+def event_time():
+    global last_event_time
+    with event_clock_lock:
+        last_event_time = max(time(), last_event_time + 1e-6)
+        return last_event_time
+
+def append_order_events(cursor, event, orders, at):
+    cursor.executemany("""
+    INSERT INTO order_events (order_id, username, drink, quantity, event, at) VALUES (?, ?, ?, ?, ?, ?)
+    """, [(order_id, username, drink, quantity, event, at) for order_id, username, drink, quantity in orders])
+    on_commit(open_orders.apply, event, orders)
+
+def insert_order(cursor, username, role, drink, quantity, request_key=None):
+    # request_key (Chat und Nachricht) macht das Einfügen idempotent: dieselbe Mengen-Nachricht
+    # ergibt höchstens eine Bestellung, auch wenn Telegram sie erneut zustellt
+    created_at = event_time()
     cursor.execute("""
-    INSERT INTO orders (username, role, drink, quantity, status) 
-    VALUES (?, ?, ?, ?, 'offen')
-    """, (username, role, drink, quantity))
-
-def update_order_status(cursor, order_id):
+    INSERT OR IGNORE INTO orders (username, role, drink, quantity, status, created_at, request_key) 
+    VALUES (?, ?, ?, ?, 'offen', ?, ?)
+    """, (username, role, drink, quantity, created_at, request_key))
+    inserted = cursor.rowcount
+    if inserted:
+        append_order_events(cursor, "created", [(cursor.lastrowid, username, drink, quantity)], created_at)
+    return inserted
+
+def insert_orders(cursor, username, role, items):
+    created_at = event_time()
+    orders = []
+    for drink, quantity in items:
+        cursor.execute("""
+        INSERT INTO orders (username, role, drink, quantity, status, created_at) 
+        VALUES (?, ?, ?, ?, 'offen', ?)
+        """, (username, role, drink, quantity, created_at))
+        orders.append((cursor.lastrowid, username, drink, quantity))
+    append_order_events(cursor, "created", orders, created_at)
+    return len(orders)
+
+def get_order_events(cursor, after_id):
     cursor.execute("""
-    UPDATE orders SET status = 'entsandt' WHERE id = ?
-    """, (order_id,))
+    SELECT id, order_id, username, drink, quantity, event, at FROM order_events WHERE id > ? ORDER BY id
+    """, (after_id,))
+    return cursor.fetchall()
 
-def get_open_orders(cursor, username=None):
-    query = """
-    SELECT id AS order_id, username, drink, quantity, status FROM orders 
-    WHERE status = 'offen' """
-    params = []
-    if username:
-        query += "AND username = ?"
-        params.append(username)
-    cursor.execute(query, params)
+def get_open_orders(cursor):
+    # Sortiert wie idx_orders_open, sonst liest SQLite für ORDER BY id die ganze Tabelle;
+    # pro Bar bleibt die Bestellreihenfolge erhalten
+    cursor.execute("SELECT id, username, drink, quantity FROM orders WHERE status = 'offen' ORDER BY username, id")
     return cursor.fetchall()
 
+def mark_orders_sent(cursor, order_ids):
+    # Eine Transaktion für alle Bestellungen; zurück kommen nur die, die wirklich noch offen waren.
+    # BEGIN IMMEDIATE nimmt die Schreibsperre schon vor dem SELECT: gleichzeitige Aufrufe für
+    # dieselben Bestellungen sehen sie erst nach dem Commit, dann nicht mehr als offen
+    # (geprüft mit simulation/concurrency.py)
+    placeholders = ", ".join("?" * len(order_ids))
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(f"""
+    SELECT id, username, drink, quantity FROM orders WHERE id IN ({placeholders}) AND status = 'offen'
+    """, list(order_ids))
+    rows = cursor.fetchall()
+    if rows:
+        sent_at = event_time()
+        cursor.execute(f"""
+        UPDATE orders SET status = 'entsandt', sent_at = ? WHERE id IN ({", ".join("?" * len(rows))})
+        """, [sent_at] + [row[0] for row in rows])
+        append_order_events(cursor, "sent", rows, sent_at)
+    return rows
+
 def get_order_by_id(cursor, order_id):
     query = """
     SELECT id AS order_id, username, drink, quantity, status FROM orders 
@@ -108,9 +366,266 @@ def get_order_by_id(cursor, order_id):
     return cursor.fetchone()
 
 
-# Initial database setup
-db_operation(create_orders_table)
-db_operation(create_sessions_table)
+# Schema-Migrationen: Die Versionsnummer steht in PRAGMA user_version,
+# neue Migrationen werden nur hinten an MIGRATIONS angehängt.
+def add_order_timestamps(cursor):
+    cursor.execute("ALTER TABLE orders ADD COLUMN created_at REAL")
+    cursor.execute("ALTER TABLE orders ADD COLUMN sent_at REAL")
+
+def add_open_order_indexes(cursor):
+    # Partieller, abdeckender Index: get_open_orders liest nur noch die offenen Bestellungen
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_open
+    ON orders (username, id, drink, quantity, status) WHERE status = 'offen'
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username)")
+
+def add_open_order_groups_index(cursor):
+    # Offene Bestellungen nach (Bar, Getränk) sortiert: Seiten per Keyset ohne Sortieren
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_orders_open_groups
+    ON orders (username, drink, quantity, status) WHERE status = 'offen'
+    """)
+
+def create_order_events_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        drink TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        at REAL NOT NULL
+    )
+    """)
+    # Bisherige Bestellungen aus den Zeitstempeln nachtragen
+    cursor.execute("""
+    INSERT INTO order_events (order_id, username, drink, quantity, event, at)
+    SELECT id, username, drink, quantity, 'created', created_at FROM orders WHERE created_at IS NOT NULL
+    UNION ALL
+    SELECT id, username, drink, quantity, 'sent', sent_at FROM orders WHERE sent_at IS NOT NULL
+    ORDER BY 6
+    """)
+
+def add_order_request_keys(cursor):
+    cursor.execute("ALTER TABLE orders ADD COLUMN request_key TEXT")
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_request_key
+    ON orders (request_key) WHERE request_key IS NOT NULL
+    """)
+
+def drop_open_order_groups_index(cursor):
+    # Die Nachschub-Liste wird seit OpenOrders aus dem Speicher geblättert
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_open_groups")
+
+MIGRATIONS = [
+    create_orders_table,
+    create_sessions_table,
+    add_order_timestamps,
+    add_open_order_indexes,
+    botkern.create_conversations_table,
+    add_open_order_groups_index,
+    create_order_events_table,
+    add_order_request_keys,
+    drop_open_order_groups_index,
+]
+
+def run_migrations(cursor):
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor.execute("BEGIN")
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
+        cursor.execute("COMMIT")
+
+def migrate_database():
+    # Nicht über db_operation: eine fehlgeschlagene Migration bricht den Start ab (SetupError),
+    # statt den Bot mit einem alten Schema laufen zu lassen
+    conn = database.connection()
+    cursor = conn.cursor()
+    try:
+        run_migrations(cursor)
+    except Exception as e:
+        conn.rollback()
+        cursor.execute("PRAGMA user_version")
+        raise botkern.SetupError(f"Datenbank-Migration fehlgeschlagen (Schema-Version {cursor.fetchone()[0]}): {e}")
+    finally:
+        cursor.close()
+
+
+# Sicherungen: alle BACKUP_INTERVAL Sekunden ein Schnappschuss von orders.db über die
+# Online-Backup-API von SQLite, in Schritten zu BACKUP_PAGES Seiten mit kurzer Pause dazwischen.
+# Die Quellverbindung hält währenddessen eine Lesetransaktion offen: im WAL-Modus blockiert das
+# keine Schreiber, und die Kopie muss nicht nach jeder neuen Bestellung von vorn beginnen.
+# Neben jedem Schnappschuss liegt ein Export der Bestellungen (BACKUP_EXPORT: csv oder jsonl).
+# Fehlt orders.db beim Start, wird der neueste Schnappschuss zurückgespielt; BACKUP_RESTORE
+# (Pfad oder "latest") erzwingt das auch bei vorhandener Datenbank.
+BACKUP_DIR = setting("BACKUP_DIR", os.path.join(BASE_DIR, "backups"))
+BACKUP_INTERVAL = int(setting("BACKUP_INTERVAL", "300"))  # Sekunden, 0 = aus
+BACKUP_PAGES = int(setting("BACKUP_PAGES", "64"))
+BACKUP_PAUSE_MS = int(setting("BACKUP_PAUSE_MS", "5"))
+BACKUP_KEEP = int(setting("BACKUP_KEEP", "12"))  # 0 = alle behalten
+BACKUP_EXPORT = setting("BACKUP_EXPORT", "csv")
+BACKUP_RESTORE = setting("BACKUP_RESTORE", "")
+
+backups = botkern.Backups(DB_FILE, BACKUP_DIR, "orders-", "SELECT * FROM orders ORDER BY id", metrics,
+                          BACKUP_INTERVAL, BACKUP_PAGES, BACKUP_PAUSE_MS, BACKUP_KEEP, BACKUP_EXPORT, BACKUP_RESTORE)
+
+
+# Write-through Session-Cache vor der sessions-Tabelle:
+# chat_id -> (username, role) und umgekehrt username -> {chat_id, ...}. save_session und
+# delete_session tragen Änderungen erst nach dem Commit ein, der Cache folgt also nur
+# Schreibvorgängen, die wirklich in der Datenbank stehen.
+session_cache = {}
+chat_ids_by_username = {}
+session_lock = threading.Lock()
+
+def get_all_sessions(cursor):
+    cursor.execute("SELECT chat_id, username, role FROM sessions")
+    return cursor.fetchall()
+
+def load_session_cache():
+    with session_lock:
+        session_cache.clear()
+        chat_ids_by_username.clear()
+        for chat_id, username, role in db_operation(get_all_sessions) or []:
+            session_cache[chat_id] = (username, role)
+            chat_ids_by_username.setdefault(username, set()).add(chat_id)
+
+def cached_session(chat_id):
+    return session_cache.get(chat_id)
+
+def cached_chat_ids(username):
+    return list(chat_ids_by_username.get(username, ()))
+
+def remember_session(chat_id, username, role):
+    with session_lock:
+        previous = session_cache.get(chat_id)
+        if previous:
+            chat_ids_by_username.get(previous[0], set()).discard(chat_id)
+        session_cache[chat_id] = (username, role)
+        chat_ids_by_username.setdefault(username, set()).add(chat_id)
+
+def forget_session(chat_id):
+    with session_lock:
+        previous = session_cache.pop(chat_id, None)
+        if previous:
+            chat_ids_by_username.get(previous[0], set()).discard(chat_id)
+
+# True, wenn die Sitzung gespeichert bzw. gelöscht wurde; bei einem Datenbankfehler None
+def login_session(chat_id, username, role):
+    return db_operation(save_session, chat_id, username, role)
+
+def logout_session(chat_id):
+    return db_operation(delete_session, chat_id)
+
+
+# Offene Bestellungen im Speicher, nach Bar und nach (Bar, Getränk) gruppiert. Wird beim
+# Start aus SQLite geladen und danach über on_commit aus dem Ereignis-Log fortgeschrieben.
+# version zählt jede Änderung mit, damit unveränderte Ansichten nicht neu gebaut werden.
+class OpenOrders:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.orders = {}         # order_id -> (Bar, Getränk, Menge)
+        self.by_bar = {}         # Bar -> {order_id: (Getränk, Menge)} in Bestellreihenfolge
+        self.groups = {}         # (Bar, Getränk) -> {order_id: Menge}
+        self.totals = {}         # (Bar, Getränk) -> Gesamtmenge
+        self.version = 0
+        self.bar_versions = {}   # Bar -> version bei der letzten Änderung dieser Bar
+        self.sorted_keys = None  # Gruppenschlüssel sortiert, None = neu sortieren
+
+    def load(self, rows):
+        with self.lock:
+            self.orders.clear()
+            self.by_bar.clear()
+            self.groups.clear()
+            self.totals.clear()
+            for order_id, username, drink, quantity in rows:
+                self._add(order_id, username, drink, quantity)
+            self.version += 1
+            self.sorted_keys = None
+
+    def _add(self, order_id, username, drink, quantity):
+        if order_id in self.orders:
+            return
+        self.orders[order_id] = (username, drink, quantity)
+        self.by_bar.setdefault(username, {})[order_id] = (drink, quantity)
+        key = (username, drink)
+        if key not in self.groups:
+            self.groups[key] = {}
+            self.totals[key] = 0
+            self.sorted_keys = None
+        self.groups[key][order_id] = quantity
+        self.totals[key] += quantity
+
+    def _remove(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return
+        username, drink, quantity = order
+        del self.by_bar[username][order_id]
+        key = (username, drink)
+        del self.groups[key][order_id]
+        self.totals[key] -= quantity
+        if not self.groups[key]:
+            del self.groups[key]
+            del self.totals[key]
+            self.sorted_keys = None
+
+    def apply(self, event, orders):
+        with self.lock:
+            self.version += 1
+            for order_id, username, drink, quantity in orders:
+                if event == "created":
+                    self._add(order_id, username, drink, quantity)
+                elif event == "sent":
+                    self._remove(order_id)
+                self.bar_versions[username] = self.version
+
+    def bar_version(self, username):
+        return self.bar_versions.get(username, 0)
+
+    def bar_orders(self, username):
+        with self.lock:
+            return [(order_id, drink, quantity) for order_id, (drink, quantity) in self.by_bar.get(username, {}).items()]
+
+    def order_ids(self, username, drink=None):
+        with self.lock:
+            if drink:
+                return list(self.groups.get((username, drink), ()))
+            return list(self.by_bar.get(username, ()))
+
+    def first_order_id(self, username, drink):
+        with self.lock:
+            return next(iter(self.groups.get((username, drink), ())), None)
+
+    def order_group(self, order_id):
+        with self.lock:
+            order = self.orders.get(order_id)
+            return order[:2] if order else (None, None)
+
+    def group_page(self, limit, start=None, username=None, before=False):
+        # Gruppen (Bar, Getränk, Menge, Anzahl) ab bzw. vor dem Schlüssel start
+        with self.lock:
+            if self.sorted_keys is None:
+                self.sorted_keys = sorted(self.groups)
+            keys = self.sorted_keys
+            if username:
+                keys = keys[bisect_left(keys, (username,)):bisect_left(keys, (username, chr(0x10FFFF)))]
+            position = bisect_left(keys, tuple(start)) if start else (len(keys) if before else 0)
+            page = keys[max(0, position - limit):position] if before else keys[position:position + limit]
+            return [(user, drink, self.totals[(user, drink)], len(self.groups[(user, drink)])) for user, drink in page]
+
+open_orders = OpenOrders()
+
+
+# Gesprächszustand pro Chat (z.B. "wartet auf die Menge für Getränk X")
+CONVERSATION_TTL = int(setting("CONVERSATION_TTL", "1800"))  # Sekunden
+MAX_CONVERSATIONS = int(setting("MAX_CONVERSATIONS", "10000"))
+
+conversations = botkern.ConversationStore(database, CONVERSATION_TTL, MAX_CONVERSATIONS)
 
 
 # Helper: Prüft Login
@@ -126,6 +641,7 @@ def register_commands():
         types.BotCommand("start", "Starte den Bot"),
         types.BotCommand("login", "Einloggen mit Benutzername und Passwort"),
         types.BotCommand("logout", "Ausloggen"),
+        types.BotCommand("stats", "Statistik für den Nachschub"),
     ]
     bot.set_my_commands(commands)
 
@@ -133,7 +649,9 @@ def register_commands():
 @bot.message_handler(commands=["start"])
 def handle_start(message):
     chat_id = message.chat.id
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
+    # /start zeigt die Ansichten wieder ganz unten im Chat an
+    forget_dashboards(chat_id, delete=True)
     if not session:
         bot.send_message(
             chat_id,
@@ -151,7 +669,7 @@ def handle_start(message):
 @bot.message_handler(commands=["login"])
 def handle_login(message):
     chat_id = message.chat.id
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
     if session:
         bot.send_message(chat_id, "Du bist bereits eingeloggt.")
         return
@@ -164,160 +682,292 @@ def handle_login(message):
 
     role = authenticate_user(username, password)
     if role:
-        db_operation(save_session, chat_id, username, role)
+        if not login_session(chat_id, username, role):
+            bot.send_message(chat_id, "Login fehlgeschlagen, bitte versuche es später erneut.")
+            return
         bot.send_message(chat_id, f"Login erfolgreich!")
         if role == "bar":
-            show_bar_orders(chat_id, username)
             show_drink_menu(chat_id, username)
         elif role == "nachschub":
+            open_orders_pages.pop(chat_id, None)
             show_open_orders_for_nachschub(chat_id)
     else:
         bot.send_message(chat_id, "Ungültige Zugangsdaten. Bitte versuche es erneut.")
 
 
-# Zeigt alle offenen Bestellungen für Nachschub-Mitarbeiter nach Login
+# Zeigt die offenen Bestellungen für Nachschub-Mitarbeiter seitenweise an. Gleiche Getränke
+# einer Bar werden zu einer Zeile zusammengefasst; pro Chat werden Bar-Filter und der erste
+# Schlüssel (Bar, Getränk) der aktuellen Seite gemerkt.
+OPEN_ORDERS_PAGE_SIZE = int(setting("OPEN_ORDERS_PAGE_SIZE", "15"))
+
+open_orders_pages = {}  # chat_id -> (Bar-Filter oder None, Startschlüssel oder None)
+
+def group_key(username, drink):
+    if username in BAR_INDEX and drink in DRINK_INDEX:
+        return f"{BAR_INDEX[username]}:{DRINK_INDEX[drink]}"
+    # Bar oder Getränk stehen nicht (mehr) in der config.json: die Gruppe wird über ihre
+    # älteste offene Bestellung angesprochen
+    return f"#{open_orders.first_order_id(username, drink)}"
+
+def parse_group_key(key):
+    if key.startswith("#"):
+        return open_orders.order_group(int(key[1:])) if key[1:].isdigit() else (None, None)
+    bar_index, _, drink_index = key.partition(":")
+    if not bar_index.isdigit() or drink_index and not drink_index.isdigit():
+        return None, None
+    try:
+        return BAR_NAMES[int(bar_index)], DRINKS[int(drink_index)] if drink_index else None
+    except IndexError:
+        return None, None
+
+def page_start(key):
+    # Startschlüssel einer Seite; ungültige oder unvollständige Schlüssel (z.B. aus alten
+    # Nachrichten nach einer Änderung der config.json) zeigen die erste Seite
+    username, drink = parse_group_key(key)
+    return (username, drink) if username and drink else None
+
 def show_open_orders_for_nachschub(chat_id):
-    rows = db_operation(get_open_orders)
-    if not rows:
-        bot.send_message(chat_id, "📋 *Keine offenen Bestellungen vorhanden.*", parse_mode="Markdown")
+    bar_filter, start = open_orders_pages.get(chat_id, (None, None))
+    step, selected = conversations.current(chat_id)
+    state = (open_orders.version, bar_filter, start, step, selected)
+    if dashboard_unchanged(chat_id, "open_orders", state):
         return
 
-    usernames = set()
-    for _, username, _, _, _ in rows:
-        usernames.add(username)
+    rows = open_orders.group_page(OPEN_ORDERS_PAGE_SIZE + 1, start, bar_filter)
+    if not rows and start:
+        # Die Seite ist leer geworden: zurück zum Anfang
+        start = None
+        open_orders_pages[chat_id] = (bar_filter, None)
+        rows = open_orders.group_page(OPEN_ORDERS_PAGE_SIZE + 1, None, bar_filter)
 
-    bar_orders = {}
-    for username in usernames:
-        bar_orders[username] = []
+    if not rows:
+        markup = types.InlineKeyboardMarkup()
+        if bar_filter:
+            markup.add(types.InlineKeyboardButton("🔎 Alle Bars anzeigen", callback_data="page:all"))
+            text = f"📋 *Keine offenen Bestellungen für {bar_filter} vorhanden.*"
+        else:
+            text = "📋 *Keine offenen Bestellungen vorhanden.*"
+        render_dashboard(chat_id, "open_orders", text, markup, state)
+        return
 
-    for order_id, username, drink, quantity, status in rows:
-        if status == "offen":
-            bar_orders[username].append({
-                "order_id": order_id,
-                "drink": drink,
-                "quantity": quantity,
-            })
+    next_row = rows[OPEN_ORDERS_PAGE_SIZE] if len(rows) > OPEN_ORDERS_PAGE_SIZE else None
+    rows = rows[:OPEN_ORDERS_PAGE_SIZE]
+    selecting = step == "select"
 
     markup = types.InlineKeyboardMarkup(row_width=1)
-    for user, orders in bar_orders.items():
-        markup.add(types.InlineKeyboardButton(
-            f"-- Bestellungen für {user} ({len(orders)}): --",
-            callback_data=f"process_order:0"
-        ))
-        for order in orders:
+    for index, (user, drink, quantity, orders) in enumerate(rows):
+        if index == 0 or rows[index - 1][0] != user:
+            markup.add(types.InlineKeyboardButton(
+                f"-- Bestellungen für {user}: --",
+                callback_data="page:all" if bar_filter else f"page:bar:{group_key(user, drink)}"
+            ))
+        key = group_key(user, drink)
+        label = f"{quantity} mal '{drink}'"
+        if orders > 1:
+            label += f" ({orders} Bestellungen)"
+        if selecting:
             markup.add(types.InlineKeyboardButton(
-                f"{order['quantity']} mal '{order['drink']}'",
-                callback_data=f"process_order:{order['order_id']}"
+                ("☑ " if key in selected else "☐ ") + label,
+                callback_data=f"select:toggle:{key}"
+            ))
+        else:
+            markup.add(types.InlineKeyboardButton(label, callback_data=f"process_group:{key}"))
+        last_of_bar = index == len(rows) - 1 or rows[index + 1][0] != user
+        if last_of_bar and not selecting:
+            markup.add(types.InlineKeyboardButton(
+                f"✅ Alle für {user} absenden",
+                callback_data=f"process_bar:{key}"
             ))
 
-    bot.send_message(
-        chat_id,
-        "📋 *Offene Bestellungen für Nachschub:*",
-        reply_markup=markup,
-        parse_mode="Markdown",
-    )
+    navigation = []
+    if start:
+        navigation.append(types.InlineKeyboardButton("◀ Zurück", callback_data=f"page:before:{group_key(*rows[0][:2])}"))
+    if next_row:
+        navigation.append(types.InlineKeyboardButton("Weiter ▶", callback_data=f"page:from:{group_key(*next_row[:2])}"))
+    if navigation:
+        markup.row(*navigation)
+
+    if selecting:
+        markup.row(
+            types.InlineKeyboardButton(f"✅ Auswahl absenden ({len(selected)})", callback_data="select:submit"),
+            types.InlineKeyboardButton("✖ Abbrechen", callback_data="select:cancel"),
+        )
+    else:
+        markup.add(types.InlineKeyboardButton("☑ Mehrfachauswahl", callback_data="select:start"))
 
-# Handle Callback für Nachschub, wenn eine Bestellung ausgewählt wurde
-@bot.callback_query_handler(func=lambda call: call.data.startswith("process_order:"))
-def process_order(call):
+    title = f"📋 *Offene Bestellungen für Nachschub ({bar_filter}):*" if bar_filter else "📋 *Offene Bestellungen für Nachschub:*"
+    render_dashboard(chat_id, "open_orders", title, markup, state)
+
+# Blättern und Filtern der Nachschub-Liste
+@bot.callback_query_handler(func=lambda call: call.data.startswith("page:"))
+def handle_page(call):
+    chat_id = call.message.chat.id
+    bar_filter, _ = open_orders_pages.get(chat_id, (None, None))
+    action, _, key = call.data[len("page:"):].partition(":")
+
+    if action == "all":
+        open_orders_pages[chat_id] = (None, None)
+    elif action == "bar":
+        bar_name, _ = parse_group_key(key)
+        open_orders_pages[chat_id] = (bar_name, None)
+    elif action == "from":
+        open_orders_pages[chat_id] = (bar_filter, page_start(key))
+    elif action == "before":
+        start = page_start(key)
+        if start:
+            previous = open_orders.group_page(OPEN_ORDERS_PAGE_SIZE + 1, start, bar_filter, True)
+            # Liegt vor der vorigen Seite nichts mehr, beginnt sie am Anfang der Liste
+            start = previous[1][:2] if len(previous) > OPEN_ORDERS_PAGE_SIZE else None
+        open_orders_pages[chat_id] = (bar_filter, start)
+
+    bot.answer_callback_query(call.id)
+    show_open_orders_for_nachschub(chat_id)
+
+def refresh_nachschub_dashboards():
+    for chat_id in cached_chat_ids('Nachschub'):
+        enqueue_send(("show_open_orders_for_nachschub", chat_id), show_open_orders_for_nachschub, chat_id)
+
+def group_order_ids(key):
+    username, drink = parse_group_key(key)
+    if not username:
+        return []
+    return open_orders.order_ids(username, drink)
+
+def fulfil_orders(chat_id, order_ids):
+    """Markiert mehrere Bestellungen auf einmal als abgesendet: eine Meldung pro Bar und eine
+    Aktualisierung der Listen. Gibt die Anzahl der tatsächlich geänderten Bestellungen zurück."""
+    rows = db_operation(mark_orders_sent, order_ids) if order_ids else []
+    if not rows:
+        return 0
+    count("orders_sent", len(rows))
+
+    sent_by_bar = {}
+    for _, username, drink, quantity in rows:
+        sent_by_bar.setdefault(username, []).append(f"{quantity} mal '{drink}'")
+    for username, orders in sent_by_bar.items():
+        notify_bar_worker(f"Bestellung von {username}: {', '.join(orders)} wurde als 'abgesendet' markiert.", username)
+
+    show_open_orders_for_nachschub(chat_id)
+    refresh_nachschub_dashboards()
+    return len(rows)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(("process_group:", "process_bar:")))
+def process_orders_bulk(call):
     chat_id = call.message.chat.id
-    order_id = int(call.data.split(":")[1])
+    session = cached_session(chat_id)
+    if not session or session[1] != "nachschub":
+        bot.answer_callback_query(call.id, "❌ Nur für Nachschub-Mitarbeiter verfügbar.")
+        return
 
-    if order_id == 0:
-        bot.answer_callback_query(call.id, "❌ Dieser Knopf ist nicht zum drücken gedacht.")
+    action, _, key = call.data.partition(":")
+    username, drink = parse_group_key(key)
+    if action == "process_bar":
+        drink = None
+    sent = fulfil_orders(chat_id, open_orders.order_ids(username, drink) if username else [])
+    if sent:
+        bot.answer_callback_query(call.id, f"✅ {sent} Bestellung(en) als 'abgesendet' markiert.")
+    else:
+        bot.answer_callback_query(call.id, "❌ Diese Bestellungen sind bereits abgeschlossen.")
+
+# Mehrfachauswahl: Zeilen an- und abwählen, dann gemeinsam absenden
+@bot.callback_query_handler(func=lambda call: call.data.startswith("select:"))
+def handle_selection(call):
+    chat_id = call.message.chat.id
+    session = cached_session(chat_id)
+    if not session or session[1] != "nachschub":
+        bot.answer_callback_query(call.id, "❌ Nur für Nachschub-Mitarbeiter verfügbar.")
         return
 
-    order = db_operation(get_order_by_id, order_id)
-    if not order:
-        bot.answer_callback_query(call.id, "❌ Bestellung nicht gefunden.")
+    action, _, key = call.data[len("select:"):].partition(":")
+    step, selected = conversations.current(chat_id)
+    selected = list(selected) if step == "select" else []
+
+    if action == "start":
+        conversations.set_step(chat_id, "select")
+        bot.answer_callback_query(call.id)
+    elif action == "toggle":
+        if key in selected:
+            selected.remove(key)
+        else:
+            selected.append(key)
+        conversations.set_step(chat_id, "select", *selected)
+        bot.answer_callback_query(call.id)
+    elif action == "submit":
+        conversations.take_step(chat_id)
+        order_ids = [order_id for key in selected for order_id in group_order_ids(key)]
+        sent = fulfil_orders(chat_id, order_ids)
+        bot.answer_callback_query(call.id, f"✅ {sent} Bestellung(en) als 'abgesendet' markiert.")
+        if sent:
+            return
+    elif action == "cancel":
+        conversations.take_step(chat_id)
+        bot.answer_callback_query(call.id)
+    show_open_orders_for_nachschub(chat_id)
+
+# Einzelne Bestellung absenden (Knöpfe aus älteren Listen). Läuft wie die Gruppen über
+# fulfil_orders und damit über denselben Compare-and-set in mark_orders_sent
+@bot.callback_query_handler(func=lambda call: call.data.startswith("process_order:"))
+def process_order(call):
+    chat_id = call.message.chat.id
+    session = cached_session(chat_id)
+    if not session or session[1] != "nachschub":
+        bot.answer_callback_query(call.id, "❌ Nur für Nachschub-Mitarbeiter verfügbar.")
         return
 
-    _, username, drink, quantity, status = order
-    if status != "offen":
-        bot.answer_callback_query(call.id, "❌ Diese Bestellung ist bereits abgeschlossen.")
+    order_id = call.data.split(":")[1]
+    if not order_id.isdigit() or int(order_id) == 0:
+        bot.answer_callback_query(call.id, "❌ Dieser Knopf ist nicht zum drücken gedacht.")
         return
 
-    db_operation(update_order_status, order_id)
-    notify_bar_worker(f"Bestellung von {username}: {quantity} mal '{drink}' wurde als 'abgesendet' markiert.", username)
-    bot.answer_callback_query(call.id, "✅ Bestellung wurde als 'abgesendet' markiert.")
-    msg = bot.send_message(chat_id, "✅ Bestellung wurde als 'abgesendet' markiert.")
-    sleep(1)
-    bot.delete_message(chat_id, msg.message_id)
-    bot.delete_message(chat_id, call.message.message_id)
-    show_open_orders_for_nachschub(chat_id)
+    # Nur wer die Bestellung tatsächlich von 'offen' umstellt, benachrichtigt die Bar
+    if fulfil_orders(chat_id, [int(order_id)]):
+        bot.answer_callback_query(call.id, "✅ Bestellung wurde als 'abgesendet' markiert.")
+    elif db_operation(get_order_by_id, int(order_id)):
+        bot.answer_callback_query(call.id, "❌ Diese Bestellung ist bereits abgeschlossen.")
+    else:
+        bot.answer_callback_query(call.id, "❌ Bestellung nicht gefunden.")
+    if call.message.message_id != dashboard_message_id(chat_id, "open_orders"):
+        schedule_delete(chat_id, call.message.message_id, 0)
 
 # Bar-Arbeiter: Eigene Bestellungen anzeigen
 def show_bar_orders(chat_id, username):
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
     if not session or session[1] != "bar":
         bot.send_message(chat_id, "❌ Dieser Befehl ist nur für Bar-Arbeiter verfügbar.")
         return
 
-    bar_name = username
-    assigned_drinks = BARS.get(bar_name, [])
-    rows = db_operation(get_open_orders, username)
-
-    if not rows:
+    state = open_orders.bar_version(username)
+    if dashboard_unchanged(chat_id, "bar_orders", state):
         return
 
     markup = types.InlineKeyboardMarkup(row_width=1)
-    for order_id, _, drink, quantity, status in rows:
-        if status == "offen":
-            markup.add(types.InlineKeyboardButton(
-                f"{quantity} mal '{drink}'",
-                callback_data=f"order:{order_id}"
-            ))
-
-    bot.send_message(
-        chat_id,
-        "📋 *Deine offenen Bestellungen:*",
-        reply_markup=markup,
-        parse_mode="Markdown",
-    )
+    for order_id, drink, quantity in open_orders.bar_orders(username):
+        markup.add(types.InlineKeyboardButton(
+            f"{quantity} mal '{drink}'",
+            callback_data=f"order:{drink}"
+        ))
 
-# Globale Variable für die Bestellungsmenge
-chat_info = {}
+    render_dashboard(chat_id, "bar_orders", "📋 *Deine offenen Bestellungen:*", markup, state)
 
 # Getränkemenü anzeigen (optimierte Darstellung)
 def show_drink_menu(chat_id, username):
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
     if not session:
         bot.send_message(chat_id, "Bitte logge dich zuerst ein mit `/login`.")
         return
 
     bar_name = username
-    assigned_drinks = BARS.get(bar_name, [])
-
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    for drink in assigned_drinks:
-        markup.add(types.InlineKeyboardButton(drink, callback_data=f"order:{drink}"))
-
-    msg = bot.send_message(
-        chat_id,
-        "🍹 *Wähle ein Getränk aus:*",
-        reply_markup=markup,
-        parse_mode="Markdown",
-    )
+    markup = DRINK_MENUS.get(bar_name) or types.InlineKeyboardMarkup()
 
-    open_orders = db_operation(get_open_orders, username)
-    markup_open_orders = types.InlineKeyboardMarkup(row_width=2)
-    for _, _, drink, quantity, _ in open_orders:
-        markup_open_orders.add(types.InlineKeyboardButton(f"{quantity} '{drink}'", callback_data=f"order:{drink}"))
-
-    msg2 = bot.send_message(
-        chat_id,
-        "📋 *Deine offenen Bestellungen:*",
-        reply_markup=markup_open_orders,
-        parse_mode="Markdown",
-    )
-
-    chat_info[chat_id] = {"drink_menu_msg": msg, "open_order_msg": msg2}
+    conversations.take_step(chat_id)
+    render_dashboard(chat_id, "drink_menu", "🍹 *Wähle ein Getränk aus:*", markup)
+    show_bar_orders(chat_id, username)
 
 # Bestellung bearbeiten
 @bot.callback_query_handler(func=lambda call: call.data.startswith("order:"))
 def handle_order(call):
     chat_id = call.message.chat.id
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
 
     if not session:
         bot.send_message(chat_id, "Bitte logge dich zuerst ein mit `/login`.")
@@ -327,73 +977,330 @@ def handle_order(call):
     username = session[0]
     role = session[1]
 
+    # Ist der Warenkorb offen, legt ein Tipp auf ein Getränk eine Einheit dazu
+    step, quantities = conversations.current(chat_id)
+    if step == "cart" and drink in BARS.get(username, []):
+        change_cart(chat_id, username, {BARS[username].index(drink): 1})
+        bot.answer_callback_query(call.id)
+        return
+
     msg = bot.send_message(chat_id, f"Wie oft möchtest du '{drink}' bestellen? (Bitte eine Zahl eingeben)")
-    chat_info[chat_id] = {"drink": drink, "username": username, "role": role, "quantity_msg": msg, "drink_menu_msg": chat_info[chat_id]["drink_menu_msg"], "open_order_msg": chat_info[chat_id]["open_order_msg"]}
+    conversations.set_step(chat_id, "quantity", drink, username, role, msg.message_id)
 
 
 # Empfang der Menge und Bestellung abschließen
-@bot.message_handler(func=lambda message: message.chat.id in chat_info and
-                     "drink" in chat_info[message.chat.id].keys() and
-                     "role" in chat_info[message.chat.id].keys() and
-                     "quantity_msg" in chat_info[message.chat.id].keys() and not
+@bot.message_handler(func=lambda message: conversations.step(message.chat.id) == "quantity" and not
                      message.text.startswith("/"))
 def handle_quantity(message):
     chat_id = message.chat.id
     quantity = message.text
 
+    step, order_info = conversations.take_step(chat_id)
+    if step != "quantity":
+        msg = bot.send_message(chat_id, "❌ Keine Bestellung gefunden.")
+        schedule_delete(chat_id, msg.message_id)
+        return
+    drink, username, role, quantity_msg_id = order_info
+
     if not quantity.isdigit():
         msg = bot.send_message(chat_id, "❌ Bitte gib eine gültige Zahl ein.")
+    elif int(quantity) == 0:
+        msg = bot.send_message(chat_id, "✅ Nichts wurde bestellt.")
     else:
         quantity = int(quantity)
+        inserted = db_operation(insert_order, username, role, drink, quantity, f"{chat_id}:{message.message_id}")
+        if inserted:
+            count("orders_placed")
+            msg = bot.send_message(chat_id, f"✅ Du hast {quantity} mal '{drink}' bestellt.")
+            notify_nachschub(f"Bestellung von {username}: {quantity} mal '{drink}'")
+        elif inserted == 0:
+            msg = bot.send_message(chat_id, "ℹ️ Diese Bestellung wurde bereits aufgenommen.")
+        else:
+            msg = bot.send_message(chat_id, "❌ Die Bestellung konnte nicht gespeichert werden. Bitte versuche es erneut.")
+
+    schedule_delete(chat_id, msg.message_id)
+    schedule_delete(chat_id, message.message_id, 0)
+    schedule_delete(chat_id, quantity_msg_id, 0)
+    show_drink_menu(chat_id, username)
 
-    order_info = chat_info.pop(chat_id, None)
-    if not order_info:
-        msg = bot.send_message(chat_id, "❌ Keine Bestellung gefunden.")
-    drink = order_info["drink"]
-    username = order_info["username"]
-    role = order_info["role"]
+# Warenkorb: Eine Bar kann mehrere Getränke sammeln (per ➕/➖ oder als Text wie
+# "Puntigamer 4; Spritzer 2") und sie mit einem Knopfdruck gemeinsam bestellen.
+# Getrennt wird an Zeilenumbrüchen und ";", nicht an ",", weil Getränkenamen wie
+# "Spritzer Flascherl (0,3l x 24Stk)" selbst Kommas enthalten. Passt ein Name auf mehrere
+# Getränke, landet er mit den Kandidaten in ambiguous statt in unknown.
+def parse_order_text(bar_name, text):
+    names = BARS.get(bar_name, [])
+    drinks = [drink.casefold() for drink in names]
+    items, unknown, ambiguous = {}, [], []
+    for part in re.split(r"[;\n]+", text):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d+)\s*[x×]?\s+(.+)|(.+?)\s+[x×]?\s*(\d+)", part)
+        if not match:
+            unknown.append(part)
+            continue
+        quantity = int(match.group(1) or match.group(4))
+        name = (match.group(2) or match.group(3)).casefold()
+        matches = [index for index, drink in enumerate(drinks) if drink == name]
+        if not matches:
+            matches = [index for index, drink in enumerate(drinks) if all(word in drink for word in name.split())]
+        if len(matches) > 1 and quantity > 0:
+            ambiguous.append((part, [names[index] for index in matches]))
+            continue
+        if len(matches) != 1 or quantity <= 0:
+            unknown.append(part)
+            continue
+        items[matches[0]] = items.get(matches[0], 0) + quantity
+    return items, unknown, ambiguous
+
+def show_cart(chat_id, bar_name, quantities):
+    markup = types.InlineKeyboardMarkup()
+    for index, drink in enumerate(BARS.get(bar_name, [])):
+        markup.row(
+            types.InlineKeyboardButton("➖", callback_data=f"cart:sub:{index}"),
+            types.InlineKeyboardButton(f"{quantities[index]} × {drink}", callback_data=f"cart:add:{index}"),
+            types.InlineKeyboardButton("➕", callback_data=f"cart:add:{index}"),
+        )
+    markup.row(
+        types.InlineKeyboardButton(f"✅ Bestellen ({sum(quantities)})", callback_data="cart:submit"),
+        types.InlineKeyboardButton("✖ Abbrechen", callback_data="cart:cancel"),
+    )
+    render_dashboard(chat_id, "cart", "🛒 *Warenkorb* (➕/➖ oder als Text, z.B. `Puntigamer 4; Spritzer 2` oder eine Zeile pro Getränk)", markup)
+
+def change_cart(chat_id, bar_name, changes):
+    step, quantities = conversations.current(chat_id)
+    if step != "cart":
+        quantities = [0] * len(BARS.get(bar_name, []))
+    quantities = list(quantities)
+    for index, change in changes.items():
+        quantities[index] = max(0, quantities[index] + change)
+    conversations.set_step(chat_id, "cart", *quantities)
+    show_cart(chat_id, bar_name, quantities)
+
+def submit_cart(chat_id, username, role):
+    # Gibt die Zusammenfassung zurück, None bei leerem Warenkorb und False, wenn die Bestellung
+    # nicht gespeichert werden konnte; dann bleibt der Warenkorb für einen neuen Versuch offen
+    step, quantities = conversations.current(chat_id)
+    drinks = BARS.get(username, [])
+    items = [(drinks[index], quantity) for index, quantity in enumerate(quantities) if quantity > 0]
+    if step != "cart" or not items:
+        conversations.take_step(chat_id)
+        close_dashboard(chat_id, "cart")
+        return None
 
-    if quantity < 0:
-        msg = bot.send_message(chat_id, "❌ Bitte gib eine positive Zahl ein.")
-    elif quantity == 0:
-        msg = bot.send_message(chat_id, "✅ Nichts wurde bestellt.")
-    else:
-        db_operation(insert_order, username, role, drink, quantity)
-        msg = bot.send_message(chat_id, f"✅ Du hast {quantity} mal '{drink}' bestellt.")
-        notify_nachschub(f"Bestellung von {username}: {quantity} mal '{drink}'")
-
-    sleep(1)
-    bot.delete_message(chat_id, msg.message_id)
-    bot.delete_message(chat_id, message.message_id)
-    bot.delete_message(chat_id, order_info["quantity_msg"].message_id)
-    bot.delete_message(chat_id, order_info["drink_menu_msg"].message_id)
-    bot.delete_message(chat_id, order_info["open_order_msg"].message_id)
+    # Eine Transaktion und eine Benachrichtigung für den ganzen Warenkorb
+    inserted = db_operation(insert_orders, username, role, items)
+    if inserted is None:
+        return False
+    conversations.take_step(chat_id)
+    close_dashboard(chat_id, "cart")
+    count("orders_placed", inserted)
+    summary = ", ".join(f"{quantity} mal '{drink}'" for drink, quantity in items)
+    notify_nachschub(f"Bestellung von {username}: {summary}")
     show_drink_menu(chat_id, username)
+    return summary
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("cart:"))
+def handle_cart(call):
+    chat_id = call.message.chat.id
+    session = cached_session(chat_id)
+    if not session or session[1] != "bar":
+        bot.answer_callback_query(call.id, "❌ Nur für Bar-Arbeiter verfügbar.")
+        return
+
+    username, role = session
+    action, _, index = call.data[len("cart:"):].partition(":")
+    if action == "open":
+        change_cart(chat_id, username, {})
+        bot.answer_callback_query(call.id)
+    elif action in ("add", "sub"):
+        # Alte Knöpfe oder manipulierte callback_data können auf ein Getränk zeigen, das es an
+        # dieser Bar nicht (mehr) gibt
+        if not index.isdigit() or int(index) >= len(BARS.get(username, [])):
+            bot.answer_callback_query(call.id, "❌ Dieses Getränk gibt es an deiner Bar nicht.")
+            return
+        change_cart(chat_id, username, {int(index): 1 if action == "add" else -1})
+        bot.answer_callback_query(call.id)
+    elif action == "submit":
+        summary = submit_cart(chat_id, username, role)
+        if summary is False:
+            bot.answer_callback_query(call.id, "❌ Die Bestellung konnte nicht gespeichert werden. Bitte versuche es erneut.",
+                                      show_alert=True)
+        else:
+            bot.answer_callback_query(call.id, f"✅ Bestellt: {summary}" if summary else "🛒 Der Warenkorb ist leer.")
+    elif action == "cancel":
+        conversations.take_step(chat_id)
+        close_dashboard(chat_id, "cart")
+        bot.answer_callback_query(call.id, "Warenkorb verworfen.")
+
+# Getränke als Text landen im Warenkorb
+@bot.message_handler(func=lambda message: message.text and not message.text.startswith("/") and
+                     conversations.step(message.chat.id) in (None, "cart") and
+                     (cached_session(message.chat.id) or (None, None))[1] == "bar")
+def handle_order_text(message):
+    chat_id = message.chat.id
+    username = cached_session(chat_id)[0]
+    items, unknown, ambiguous = parse_order_text(username, message.text)
+    schedule_delete(chat_id, message.message_id, 0)
+    if unknown:
+        send_temporary_message(chat_id, "❓ Nicht erkannt: " + "; ".join(unknown))
+    for part, candidates in ambiguous:
+        send_temporary_message(chat_id, f"❓ '{part}' ist nicht eindeutig, meintest du: " + "; ".join(candidates))
+    if items:
+        change_cart(chat_id, username, items)
+
+# Benachrichtigungen werden pro Empfänger (Benutzername) NOTIFY_WINDOW_MS lang gesammelt
+# und dann als eine Nachricht plus eine Aktualisierung der Liste an jeden Chat geschickt.
+NOTIFY_WINDOW_MS = int(setting("NOTIFY_WINDOW_MS", "1500"))
+
+pending_notifications = {}  # username -> [Meldung, ...]
+notify_lock = threading.Lock()
+metrics.gauges["pending_notifications"] = lambda: sum(len(events) for events in list(pending_notifications.values()))
+
+def queue_notification(username, message, title, send_func, refresh_func, *refresh_args):
+    with notify_lock:
+        events = pending_notifications.setdefault(username, [])
+        events.append(message)
+        count("notify_events")
+        first_event = len(events) == 1
+    if first_event:
+        schedule_action(NOTIFY_WINDOW_MS, flush_notifications, username, title, send_func, refresh_func, refresh_args)
+
+def flush_notifications(username, title, send_func, refresh_func, refresh_args):
+    with notify_lock:
+        events = pending_notifications.pop(username, [])
+    if not events:
+        return
+
+    if len(events) == 1:
+        text = events[0]
+    else:
+        text = title.format(len(events)) + "\n" + "\n".join(events)
+
+    chat_ids = cached_chat_ids(username)
+    count("notify_batches")
+    count("notify_renders_saved", (len(events) - 1) * len(chat_ids))
+    for chat_id in chat_ids:
+        enqueue_send(None, send_func, chat_id, text)
+        enqueue_send((refresh_func.__name__, chat_id), refresh_func, chat_id, *refresh_args)
 
 # Nachschub benachrichtigen
 def notify_nachschub(message):
-    cursor = db_operation(get_sessions_by_username, 'Nachschub')
-    for (chat_id,) in cursor:
-        msg = bot.send_message(chat_id, message)
-        sleep(1)
-        bot.delete_message(chat_id, msg.message_id)
-        show_open_orders_for_nachschub(chat_id)
+    queue_notification('Nachschub', message, "🔔 {} neue Bestellungen:",
+                       send_temporary_message, show_open_orders_for_nachschub)
 
 def notify_bar_worker(message, username):
-    cursor = db_operation(get_sessions_by_username, username)
-    for (chat_id,) in cursor:
-        bot.send_message(chat_id, message)
-        show_bar_orders(chat_id, username)
+    queue_notification(username, message, "✅ {} Bestellungen wurden als 'abgesendet' markiert:",
+                       bot.send_message, show_bar_orders, username)
+
+# Auswertung des Ereignis-Logs: OrderStats liest bei jedem Aufruf nur die neuen Ereignisse
+# seit dem zuletzt verarbeiteten und führt Wartezeiten und Mengen pro Stunde fortlaufend mit.
+STATS_HOURS = int(setting("STATS_HOURS", "6"))
+STATS_TOP_DRINKS = 5
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds // 3600:.0f} h {seconds % 3600 / 60:.0f} min"
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class OrderStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.open_orders = {}  # order_id -> (Bar, Bestellzeitpunkt)
+        self.latencies = {}    # Bar -> sortierte Wartezeiten bis zur Absendung in Sekunden
+        self.hourly = {}       # Stunde seit Epoch -> {Getränk: Menge}
+
+    def apply(self, event_id, order_id, username, drink, quantity, event, at):
+        if event == "created":
+            self.open_orders[order_id] = (username, at)
+            drinks = self.hourly.setdefault(int(at // 3600), {})
+            drinks[drink] = drinks.get(drink, 0) + quantity
+        elif event == "sent":
+            created = self.open_orders.pop(order_id, None)
+            if created is not None:
+                insort(self.latencies.setdefault(username, []), at - created[1])
+        self.last_id = event_id
+
+    def catch_up(self):
+        global last_event_time
+        with self.lock:
+            for row in db_operation(get_order_events, self.last_id) or []:
+                self.apply(*row)
+                with event_clock_lock:
+                    last_event_time = max(last_event_time, row[6])
+
+    def report(self):
+        self.catch_up()
+        now = time()
+        with self.lock:
+            waiting = {}
+            for username, created_at in self.open_orders.values():
+                open_count, oldest = waiting.get(username, (0, now))
+                waiting[username] = (open_count + 1, min(oldest, created_at))
+
+            lines = ["📊 *Statistik*", "", "*Wartezeit bis zur Absendung (Median / p95):*"]
+            for username in sorted(set(self.latencies) | set(waiting)):
+                values = self.latencies.get(username, [])
+                line = f"{username}: "
+                if values:
+                    line += f"{format_duration(percentile(values, 0.5))} / {format_duration(percentile(values, 0.95))} ({len(values)} abgesendet)"
+                else:
+                    line += "noch nichts abgesendet"
+                if username in waiting:
+                    open_count, oldest = waiting[username]
+                    line += f", {open_count} offen seit bis zu {format_duration(now - oldest)}"
+                lines.append(line)
+            if len(lines) == 3:
+                lines.append("Noch keine Bestellungen.")
+
+            current_hour = int(now // 3600)
+            lines += ["", "*Getränke pro Stunde:*"]
+            for hour in range(current_hour - STATS_HOURS + 1, current_hour + 1):
+                if hour in self.hourly:
+                    lines.append(f"{datetime.fromtimestamp(hour * 3600):%H:00}: {sum(self.hourly[hour].values())}")
+
+            recent = {}
+            for hour in (current_hour - 1, current_hour):
+                for drink, quantity in self.hourly.get(hour, {}).items():
+                    recent[drink] = recent.get(drink, 0) + quantity
+            if recent:
+                lines += ["", "*Meistbestellt (letzte zwei Stunden):*"]
+                top = sorted(recent.items(), key=lambda item: item[1], reverse=True)[:STATS_TOP_DRINKS]
+                lines += [f"{quantity} mal '{drink}'" for drink, quantity in top]
+        return "\n".join(lines)
+
+order_stats = OrderStats()
+
+# Statistik-Kommando, nur für den Nachschub
+@bot.message_handler(commands=["stats"])
+def handle_stats(message):
+    chat_id = message.chat.id
+    session = cached_session(chat_id)
+    if not session or session[1] != "nachschub":
+        bot.send_message(chat_id, "❌ Die Statistik ist nur für den Nachschub verfügbar.")
+        return
+    bot.send_message(chat_id, order_stats.report(), parse_mode="Markdown")
 
 # Logout-Kommando
 @bot.message_handler(commands=["logout"])
 def handle_logout(message):
     chat_id = message.chat.id
-    session = db_operation(get_session, chat_id)
+    session = cached_session(chat_id)
     if not session:
         bot.send_message(chat_id, "Du bist nicht eingeloggt.")
         return
-    db_operation(delete_session, chat_id)
+    if not logout_session(chat_id):
+        bot.send_message(chat_id, "Logout fehlgeschlagen, bitte versuche es später erneut.")
+        return
+    forget_dashboards(chat_id)
+    open_orders_pages.pop(chat_id, None)
     bot.send_message(chat_id, "Logout erfolgreich!")
 
 # Fehlerbehandlung für unbekannte Befehle
@@ -405,7 +1312,45 @@ def handle_unknown_command(message):
             "⚠️ Ich habe diesen Befehl nicht erkannt. Bitte verwende die verfügbaren Befehle oder schreibe '/start'."
         )
 
+# Webhook-Betrieb: ist WEBHOOK_URL gesetzt, schickt Telegram die Updates per HTTPS an diese
+# Adresse (z.B. über einen Reverse-Proxy) statt dass der Bot sie per Long Polling abholt
+# (siehe botkern.run_webhook).
+WEBHOOK_URL = setting("WEBHOOK_URL", "")
+WEBHOOK_PORT = int(setting("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = setting("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+# Start in drei Schritten, damit host.py das Modul importieren kann, ohne dass dabei
+# schon die Datenbank angefasst oder gepollt wird
+def setup():
+    backups.restore()
+    migrate_database()
+    load_session_cache()
+    open_orders.load(db_operation(get_open_orders) or [])
+    conversations.load()
+    order_stats.catch_up()
+
+
+def start_services():
+    scheduler.start()
+    start_sender()
+    start_metrics()
+    backups.start()
+    register_commands()
+
+
+def run():
+    if WEBHOOK_URL:
+        botkern.run_webhook(bot, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_PORT)
+    else:
+        bot.remove_webhook()
+        bot.polling(none_stop=True)
+
+
 if __name__ == "__main__":
     print("Nachschub Bot läuft...")
-    register_commands()
-    bot.polling(none_stop=True)
\ No newline at end of file
+    try:
+        setup()
+    except botkern.SetupError as e:
+        sys.exit(str(e))
+    start_services()
+    run()
@@ -0,0 +1,686 @@
+# Gemeinsame Bausteine von NachschubBot (nachschub.py) und BallkoenigBot (ball.py):
+# Einstellungen, Metriken, Chat-Worker, verzögerte Aktionen, Rate-Limits für Telegram,
+# SQLite-Verbindungen, Sicherungen, Gesprächszustand und Webhook-Server. Was pro Bot getrennt
+# bleiben muss (Zähler, Limits, Datenbank, Token), steckt in Objekten, die jeder Bot selbst
+# anlegt; so verwenden im gemeinsamen Host (host.py) beide Bots dasselbe Modul.
+import csv
+import heapq
+import hmac
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic, sleep, strftime, time
+from urllib.parse import urlparse
+
+from telebot import TeleBot, apihelper, types
+
+
+# Ein Bot kann nicht starten (fehlende Datei, fehlgeschlagene Migration). Wer setup() aufruft,
+# entscheidet, was daraus folgt: der einzelne Bot beendet sich, host.py startet den anderen trotzdem.
+class SetupError(Exception):
+    pass
+
+
+def settings(prefix):
+    # Einstellungen kommen aus Umgebungsvariablen; <PREFIX>_<NAME> hat Vorrang vor <NAME>,
+    # damit beide Bots im gemeinsamen Host eigene Werte bekommen
+    def setting(name, default=None):
+        return os.getenv(f"{prefix}_{name}", os.getenv(name, default))
+    return setting
+
+
+# Metriken: Zähler, Latenz-Histogramme und Warteschlangenlängen, ein Metrics-Objekt pro Bot.
+# Abrufbar im Prometheus-Textformat unter http://<host>:<port>/metrics, zusätzlich regelmäßig
+# als Zusammenfassung im Log.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        # Obergrenze des Buckets, in dem der q-te Wert liegt
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self, prefix, labels):
+        self.prefix = prefix
+        self.labels = labels  # Histogramm -> Name seines Labels, z.B. db_seconds -> operation
+        self.lock = threading.Lock()
+        self.counters = {}    # Name -> Wert
+        self.histograms = {}  # (Name, Label) -> Histogram
+        self.gauges = {}      # Name -> Funktion, die den aktuellen Wert liefert
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, label, seconds):
+        with self.lock:
+            histogram = self.histograms.get((name, label))
+            if histogram is None:
+                histogram = self.histograms[(name, label)] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe("handler_seconds", function.__name__, monotonic() - started)
+        return wrapper
+
+    def instrument(self, bot):
+        for handlers in (bot.message_handlers, bot.callback_query_handlers):
+            for handler in handlers:
+                handler["function"] = self.timed(handler["function"])
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{self.prefix}_{name}_total {value}")
+            for (name, label), histogram in sorted(self.histograms.items()):
+                labels = f'{self.labels.get(name, "name")}="{label}"'
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += n
+                    lines.append(f'{self.prefix}_{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.prefix}_{name}_sum{{{labels}}} {histogram.total:.6f}")
+                lines.append(f"{self.prefix}_{name}_count{{{labels}}} {histogram.count}")
+        for name, gauge in sorted(self.gauges.items()):
+            lines.append(f"{self.prefix}_{name} {gauge()}")
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self):
+        with self.lock:
+            parts = [f"{name}={value}" for name, value in sorted(self.counters.items())]
+            # Die Aufrufe mit der meisten Gesamtzeit zuerst
+            slowest = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)[:5]
+            for (name, label), histogram in slowest:
+                parts.append(f"{name}[{label}] n={histogram.count} p95<={histogram.quantile(0.95) * 1000:.0f}ms "
+                             f"max={histogram.max * 1000:.0f}ms")
+        parts.extend(f"{name}={gauge()}" for name, gauge in sorted(self.gauges.items()))
+        print(f"Metriken {self.prefix}: " + ", ".join(parts))
+
+    def run_log(self, interval):
+        while True:
+            sleep(interval)
+            self.log_summary()
+
+    def start(self, bot, host, port, log_interval):
+        # Port bzw. Intervall 0 schaltet den Endpunkt bzw. die Zusammenfassung im Log ab
+        self.instrument(bot)
+        if port:
+            server = HTTPServer((host, port), MetricsHandler)
+            server.metrics = self
+            threading.Thread(target=server.serve_forever, name=f"{self.prefix}-metrics", daemon=True).start()
+        if log_interval:
+            threading.Thread(target=self.run_log, args=(log_interval,), name=f"{self.prefix}-metrics-log",
+                             daemon=True).start()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Updates verschiedener Chats werden parallel abgearbeitet, Updates desselben Chats bleiben
+# in Reihenfolge: jeder Chat ist fest einem Worker-Thread zugeordnet. Die Warteschlangen sind
+# begrenzt, bei Überlast wartet der Empfang (Polling bzw. Webhook) auf die Worker.
+CALLBACK_DEDUP_SIZE = 1000  # so viele zuletzt gesehene Callback-IDs werden gemerkt
+
+
+def update_chat_id(update):
+    if hasattr(update, "chat"):
+        return update.chat.id
+    message = getattr(update, "message", None)
+    if message is not None:
+        return message.chat.id
+    user = getattr(update, "from_user", None)
+    return user.id if user else 0
+
+
+class ChatWorkerPool:
+    # Gehört nicht fest zum Bot, damit sich im gemeinsamen Host beide Bots einen Pool teilen
+    def __init__(self, workers, queue_size):
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for number, tasks in enumerate(self.queues):
+                threading.Thread(target=self.run_worker, args=(tasks,), name=f"chat-worker-{number}", daemon=True).start()
+            self.started = True
+
+    def submit(self, bot, chat_id, task, args, kwargs):
+        if not self.started:
+            self.start()
+        self.queues[chat_id % len(self.queues)].put((bot, task, args, kwargs))
+
+    def depth(self):
+        return sum(tasks.qsize() for tasks in self.queues)
+
+    def run_worker(self, tasks):
+        while True:
+            bot, task, args, kwargs = tasks.get()
+            try:
+                task(*args, **kwargs)
+            except Exception as e:
+                if not bot._handle_exception(e):
+                    print(f"Handler error: {e}")
+
+
+class ChatOrderedBot(TeleBot):
+    def __init__(self, token, pool, metrics, **kwargs):
+        super().__init__(token, **kwargs)
+        self.pool = pool
+        self.metrics = metrics
+        self.seen_callbacks = OrderedDict()
+        self.seen_lock = threading.Lock()
+
+    def process_new_callback_query(self, new_callback_queries):
+        # Erneut zugestellte Callbacks (gleiche call.id) werden nur einmal verarbeitet
+        fresh = []
+        with self.seen_lock:
+            for call in new_callback_queries:
+                if call.id in self.seen_callbacks:
+                    self.metrics.count("callbacks_duplicate")
+                    continue
+                self.seen_callbacks[call.id] = None
+                if len(self.seen_callbacks) > CALLBACK_DEDUP_SIZE:
+                    self.seen_callbacks.popitem(last=False)
+                fresh.append(call)
+        if fresh:
+            super().process_new_callback_query(fresh)
+
+    def _exec_task(self, task, *args, **kwargs):
+        chat_id = update_chat_id(args[0]) if args else 0
+        self.pool.submit(self, chat_id, task, args, kwargs)
+
+
+# Verzögerte Aktionen (z.B. Nachrichten löschen) laufen in einem Hintergrund-Thread, damit die
+# Handler nicht mit sleep() blockieren. Fehlgeschlagene Aktionen werden bis zu retries Mal mit
+# wachsendem Abstand wiederholt.
+class Scheduler:
+    def __init__(self, name, retry_delay_ms, retries):
+        self.name = name
+        self.retry_delay_ms = retry_delay_ms
+        self.retries = retries
+        self.actions = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+
+    def schedule(self, delay_ms, func, *args, attempt=0):
+        with self.condition:
+            heapq.heappush(self.actions, (monotonic() + delay_ms / 1000, next(self.sequence), func, args, attempt))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.actions or self.actions[0][0] > monotonic():
+                    timeout = self.actions[0][0] - monotonic() if self.actions else None
+                    self.condition.wait(timeout)
+                # Alle fälligen Aktionen auf einmal abholen und gesammelt ausführen
+                now = monotonic()
+                due = []
+                while self.actions and self.actions[0][0] <= now:
+                    due.append(heapq.heappop(self.actions))
+
+            for _, _, func, args, attempt in due:
+                try:
+                    func(*args)
+                except Exception as e:
+                    # 400 = Nachricht existiert nicht mehr, ein neuer Versuch bringt nichts
+                    if getattr(e, "error_code", None) == 400:
+                        continue
+                    if attempt < self.retries:
+                        self.schedule(self.retry_delay_ms * 2 ** attempt, func, *args, attempt=attempt + 1)
+                    else:
+                        print(f"Scheduled action error: {e}")
+
+    def start(self):
+        threading.Thread(target=self.run, name=self.name, daemon=True).start()
+
+
+# Alle Telegram-Aufrufe eines Bots laufen über seinen RequestSender: globales Rate-Limit,
+# Limit pro Chat für send*-Methoden und Warten laut retry_after, wenn Telegram mit 429 antwortet.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def wait_time(self):
+        # Sekunden, bis acquire ohne Warten durchgeht (0 = sofort); verbraucht kein Token
+        with self.lock:
+            tokens = min(self.burst, self.tokens + (monotonic() - self.updated) * self.rate)
+            return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+
+class RequestSender:
+    def __init__(self, metrics, global_rate, chat_rate, chat_burst, retries):
+        self.metrics = metrics
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self.chat_buckets = {}
+
+    def chat_bucket(self, chat_id):
+        # telebot übergibt chat_id als Text, die Sende-Warteschlange als Zahl
+        chat_id = str(chat_id)
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        return bucket
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        method_name = url.rsplit("/", 1)[-1]
+        if method_name != "getUpdates":
+            chat_id = (params or {}).get("chat_id")
+            if chat_id is not None and method_name.startswith("send"):
+                self.chat_bucket(chat_id).acquire()
+            self.global_bucket.acquire()
+
+        started = monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                result = apihelper._get_req_session().request(
+                    method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+            except Exception:
+                self.metrics.count("api_errors")
+                raise
+            if result.status_code != 429 or attempt == self.retries:
+                break
+            try:
+                retry_after = result.json()["parameters"]["retry_after"]
+            except (ValueError, KeyError):
+                retry_after = 1
+            self.metrics.count("api_rate_limited")
+            sleep(retry_after)
+
+        if method_name != "getUpdates":
+            self.metrics.observe("api_seconds", method_name, monotonic() - started)
+        if result.status_code != 200:
+            self.metrics.count("api_errors")
+        return result
+
+
+# Eine langlebige Verbindung pro Thread statt connect/close bei jedem Aufruf
+class Database:
+    def __init__(self, path, metrics):
+        self.path = path
+        self.metrics = metrics
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-8000")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self.local.conn = conn
+        return conn
+
+    def run(self, func, *args):
+        # func(cursor, *args) in einer Transaktion; bei einem Fehler None
+        conn = self.connection()
+        cursor = conn.cursor()
+        self.local.after_commit = []
+        started = monotonic()
+        try:
+            result = func(cursor, *args)
+            conn.commit()
+        except Exception as e:
+            print(f"Database error: {e}")
+            self.metrics.count("db_errors")
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
+            self.metrics.observe("db_seconds", func.__name__, monotonic() - started)
+        for callback, callback_args in self.local.after_commit:
+            callback(*callback_args)
+        return result
+
+    def on_commit(self, callback, *args):
+        # Läuft erst, wenn die aktuelle Transaktion erfolgreich committet wurde
+        self.local.after_commit.append((callback, args))
+
+
+# Sicherungen: alle interval Sekunden ein Schnappschuss der Datenbank über die Online-Backup-API
+# von SQLite, in Schritten zu pages Seiten mit kurzer Pause dazwischen. Die Quellverbindung hält
+# währenddessen eine Lesetransaktion offen: im WAL-Modus blockiert das keine Schreiber, und die
+# Kopie muss nicht nach jedem neuen Schreibvorgang von vorn beginnen. Neben jedem Schnappschuss
+# liegt ein Export von export_query (export: csv oder jsonl). Fehlt die Datenbank beim Start,
+# spielt restore() den neuesten Schnappschuss zurück; restore_from (Pfad oder "latest")
+# erzwingt das auch bei vorhandener Datenbank.
+class Backups:
+    def __init__(self, db_file, directory, prefix, export_query, metrics,
+                 interval, pages, pause_ms, keep, export, restore_from):
+        self.db_file = db_file
+        self.directory = directory
+        self.prefix = prefix
+        self.export_query = export_query
+        self.metrics = metrics
+        self.interval = interval  # Sekunden, 0 = aus
+        self.pages = pages
+        self.pause_ms = pause_ms
+        self.keep = keep  # 0 = alle behalten
+        self.export = export
+        self.restore_from = restore_from
+
+    def snapshots(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(self.prefix) and name.endswith(".db"))
+
+    def copy(self, source, target):
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        try:
+            source.backup(target, pages=self.pages, progress=lambda *progress: sleep(self.pause_ms / 1000))
+        finally:
+            source.execute("COMMIT")
+        # Schnappschuss als einzelne Datei ohne -wal/-shm ablegen
+        target.execute("PRAGMA journal_mode=DELETE")
+
+    def export_rows(self, path, cursor):
+        columns = [column[0] for column in cursor.description]
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            if self.export == "jsonl":
+                for row in cursor:
+                    file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+            else:
+                writer = csv.writer(file)
+                writer.writerow(columns)
+                writer.writerows(cursor)
+
+    def backup(self):
+        started = monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.prefix}{strftime('%Y%m%d-%H%M%S')}.db")
+        source = sqlite3.connect(self.db_file, isolation_level=None)
+        target = sqlite3.connect(path + ".tmp")
+        try:
+            self.copy(source, target)
+            if self.export:
+                self.export_rows(f"{path[:-3]}.{self.export}", target.execute(self.export_query))
+        finally:
+            source.close()
+            target.close()
+        os.replace(path + ".tmp", path)
+        for old in self.snapshots()[:-self.keep]:
+            for extension in (".db", ".csv", ".jsonl"):
+                if os.path.exists(old[:-3] + extension):
+                    os.remove(old[:-3] + extension)
+        self.metrics.count("backups")
+        self.metrics.observe("backup_seconds", self.prefix.rstrip("-"), monotonic() - started)
+        return path
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.backup()
+            except Exception as e:
+                print(f"Backup error: {e}")
+                self.metrics.count("backup_errors")
+
+    def start(self):
+        if self.interval:
+            threading.Thread(target=self.run, name=f"{self.prefix}backup", daemon=True).start()
+
+    def restore(self):
+        # Läuft in setup(), bevor irgendeine Verbindung auf die Datenbank geöffnet ist
+        snapshot = self.restore_from
+        if snapshot in ("", "latest"):
+            if not snapshot and os.path.exists(self.db_file):
+                return
+            snapshots = self.snapshots()
+            if not snapshots:
+                return
+            snapshot = snapshots[-1]
+        if not os.path.exists(snapshot):
+            raise FileNotFoundError(f"Sicherung nicht gefunden: {snapshot}")
+        source = sqlite3.connect(snapshot)
+        target = sqlite3.connect(self.db_file)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        print(f"Datenbank aus {snapshot} wiederhergestellt")
+
+
+# Gesprächszustand pro Chat, gespeichert in der Tabelle conversations
+def create_conversations_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS conversations (
+        chat_id INTEGER PRIMARY KEY,
+        step TEXT,
+        args TEXT NOT NULL,
+        message_ids TEXT NOT NULL,
+        expires REAL NOT NULL
+    )
+    """)
+
+
+def save_conversation(cursor, chat_id, step, args, message_ids, expires):
+    cursor.execute("""
+    REPLACE INTO conversations (chat_id, step, args, message_ids, expires) VALUES (?, ?, ?, ?, ?)
+    """, (chat_id, step, json.dumps(args), json.dumps(message_ids), expires))
+
+
+def delete_conversation(cursor, chat_id):
+    cursor.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+
+
+def get_conversations(cursor, now):
+    cursor.execute("DELETE FROM conversations WHERE expires < ?", (now,))
+    cursor.execute("SELECT chat_id, step, args, message_ids, expires FROM conversations ORDER BY expires")
+    return cursor.fetchall()
+
+
+class Conversation:
+    __slots__ = ("step", "args", "message_ids", "expires")
+
+    def __init__(self, step=None, args=(), message_ids=(), expires=0.0):
+        self.step = step
+        self.args = tuple(args)
+        self.message_ids = list(message_ids)
+        self.expires = expires
+
+
+class ConversationStore:
+    """Gesprächszustand pro Chat: aktueller Schritt, seine Argumente und Nachrichten, die
+    später gelöscht werden sollen.
+
+    Einträge laufen nach ttl Sekunden ab und es werden höchstens max_entries gehalten (der am
+    längsten unbenutzte fliegt zuerst). Jede Änderung wird in die Tabelle conversations
+    geschrieben, damit laufende Abläufe einen Neustart überleben.
+    """
+
+    def __init__(self, database, ttl, max_entries, persistent=True):
+        self.database = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            self.entries.clear()
+            for chat_id, step, args, message_ids, expires in self.database.run(get_conversations, time()) or []:
+                self.entries[chat_id] = Conversation(step, json.loads(args), json.loads(message_ids), expires)
+
+    def _get(self, chat_id):
+        conversation = self.entries.get(chat_id)
+        if conversation is not None and conversation.expires < time():
+            self._drop(chat_id)
+            return None
+        return conversation
+
+    def _drop(self, chat_id):
+        self.entries.pop(chat_id, None)
+        if self.persistent:
+            self.database.run(delete_conversation, chat_id)
+
+    def _store(self, chat_id, conversation):
+        if conversation.step is None and not conversation.message_ids:
+            self._drop(chat_id)
+            return
+        conversation.expires = time() + self.ttl
+        self.entries[chat_id] = conversation
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+        if self.persistent:
+            self.database.run(save_conversation, chat_id, conversation.step, conversation.args,
+                              conversation.message_ids, conversation.expires)
+
+    def step(self, chat_id):
+        with self.lock:
+            conversation = self._get(chat_id)
+            return conversation.step if conversation else None
+
+    def set_step(self, chat_id, step, *args):
+        with self.lock:
+            conversation = self._get(chat_id) or Conversation()
+            conversation.step = step
+            conversation.args = args
+            self._store(chat_id, conversation)
+
+    def current(self, chat_id):
+        with self.lock:
+            conversation = self._get(chat_id)
+            if conversation is None or conversation.step is None:
+                return None, ()
+            return conversation.step, conversation.args
+
+    def take_step(self, chat_id):
+        with self.lock:
+            conversation = self._get(chat_id)
+            if conversation is None or conversation.step is None:
+                return None, ()
+            step, args = conversation.step, conversation.args
+            conversation.step, conversation.args = None, ()
+            self._store(chat_id, conversation)
+            return step, args
+
+    def add_message(self, chat_id, message_id):
+        with self.lock:
+            conversation = self._get(chat_id) or Conversation()
+            conversation.message_ids.append(message_id)
+            self._store(chat_id, conversation)
+
+    def take_messages(self, chat_id):
+        with self.lock:
+            conversation = self._get(chat_id)
+            if conversation is None or not conversation.message_ids:
+                return []
+            message_ids, conversation.message_ids = conversation.message_ids, []
+            self._store(chat_id, conversation)
+            return message_ids
+
+
+# Webhook-Betrieb: Telegram schickt die Updates per HTTPS an die Webhook-Adresse (z.B. über
+# einen Reverse-Proxy) statt dass der Bot sie per Long Polling abholt. Der lokale Server nimmt
+# die Updates nacheinander an, prüft das Secret-Token und verteilt sie auf die Chat-Worker.
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != self.server.path:
+            self.send_error(404)
+            return
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), self.server.secret.encode()):
+            self.send_error(403)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            update = types.Update.de_json(self.rfile.read(length).decode("utf-8"))
+        except (ValueError, KeyError):
+            self.send_error(400)
+            return
+        self.server.bot.process_new_updates([update])
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def webhook_server(bot, url, secret, port):
+    server = HTTPServer(("", port), WebhookHandler)
+    server.bot = bot
+    server.path = urlparse(url).path or "/"
+    server.secret = secret
+    return server
+
+
+def run_webhook(bot, url, secret, port):
+    bot.set_webhook(url=url, secret_token=secret)
+    server = webhook_server(bot, url, secret, port)
+    print(f"Webhook-Server lauscht auf Port {port}")
+    server.serve_forever()
@@ -0,0 +1,67 @@
+# Startet NachschubBot und BallkoenigBot in einem einzigen Prozess. Beide Bots teilen sich
+# die Chat-Worker und eine HTTP-Session (ein Verbindungspool zu Telegram); jeder Bot behält
+# seinen eigenen Token und seine eigenen Limits. Einstellungen pro Bot über NACHSCHUB_<NAME>
+# bzw. BALLKOENIG_<NAME>, z.B. NACHSCHUB_BOT_KEY und BALLKOENIG_BOT_KEY.
+import os
+import sys
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BASE_DIR, "NachschubBot"), os.path.join(BASE_DIR, "BallkoenigBot")]
+
+import botkern
+import nachschub
+import ball
+from telebot import apihelper
+
+# Gleichzeitig offen sind höchstens: zwei Long-Polls, die Chat-Worker und die Hintergrund-Threads
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+apihelper.session = session
+
+# Beide Module setzen beim Import ihren eigenen Request-Sender; der zuletzt importierte würde
+# gewinnen. Der Verteiler ordnet jede Anfrage anhand des Tokens in der URL dem richtigen Bot zu,
+# damit Rate-Limits und Metriken weiter pro Bot gelten.
+senders = {nachschub.TOKEN: nachschub.send_request, ball.BOT_TOKEN: ball.send_request}
+
+def send_request(method, url, params=None, files=None, timeout=None, proxies=None):
+    token = url.split("/bot", 1)[1].split("/", 1)[0]
+    return senders[token](method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+ball.bot.pool = nachschub.bot.pool
+
+
+def main():
+    if not nachschub.TOKEN or not ball.BOT_TOKEN or nachschub.TOKEN == ball.BOT_TOKEN:
+        sys.exit("NACHSCHUB_BOT_KEY und BALLKOENIG_BOT_KEY müssen gesetzt und verschieden sein.")
+    # Kann ein Bot nicht starten (z.B. fehlt kandidaten.json), läuft der andere trotzdem
+    running = []
+    for module in (nachschub, ball):
+        try:
+            module.setup()
+        except botkern.SetupError as e:
+            print(f"{module.__name__} wird nicht gestartet: {e}")
+            continue
+        module.start_services()
+        running.append(module)
+    if not running:
+        sys.exit("Kein Bot konnte starten.")
+    print(f"Bots laufen: {', '.join(module.__name__ for module in running)}")
+    threads = [threading.Thread(target=module.run, name=f"{module.__name__}-updates", daemon=True)
+               for module in running]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,714 @@
+# Einzelne Benchmarks zu den Optimierungen in nachschub.py und ball.py, damit die Zahlen aus
+# den Commit-Nachrichten nachgemessen werden können. Jeder Benchmark läuft in einem eigenen
+# Prozess mit frischen Datenbanken in einem temporären Verzeichnis; die Bots werden wie in
+# simulate.py über host.py geladen.
+#
+#   python simulation/bench.py --list
+#   python simulation/bench.py connections
+#   python simulation/bench.py all
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from time import monotonic, perf_counter, sleep
+from urllib.request import Request, urlopen
+
+from simulate import REPO_DIR, TOKENS, FakeTelegramClient, Simulation, load_bots
+
+BENCHMARKS = {}
+
+
+def benchmark(name, description):
+    def register(func):
+        BENCHMARKS[name] = (func, description)
+        return func
+    return register
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def run_threads(count, target, *args):
+    threads = [threading.Thread(target=target, args=(index,) + args) for index in range(count)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return perf_counter() - started
+
+
+# Eine Verbindung pro Aufruf (Stand vorher) gegen langlebige Verbindungen pro Thread
+def connect_per_call(db_file, func, *args):
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    try:
+        result = func(cursor, *args)
+        conn.commit()
+        return result
+    finally:
+        cursor.close()
+        conn.close()
+
+def insert_plain_order(cursor):
+    cursor.execute("""
+    INSERT INTO orders (username, role, drink, quantity, status) VALUES ('Bar', 'bar', 'Bier', 1, 'offen')
+    """)
+
+@benchmark("connections", "Verbindung pro Aufruf gegen Verbindung pro Thread (WAL)")
+def bench_connections(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    nachschub.setup()
+    before_db = os.path.join(data_dir, "vorher.db")
+    connect_per_call(before_db, lambda cursor: cursor.execute("""
+    CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL, role TEXT NOT NULL,
+                         drink TEXT NOT NULL, quantity INTEGER NOT NULL, status TEXT NOT NULL DEFAULT 'offen')
+    """))
+
+    variants = [("Verbindung pro Aufruf", lambda: connect_per_call(before_db, insert_plain_order)),
+                ("Verbindung pro Thread, WAL", lambda: nachschub.db_operation(insert_plain_order))]
+    print(f"{args.threads} Threads x {args.inserts} Inserts")
+    for label, operation in variants:
+        latencies = [[] for _ in range(args.threads)]
+        def writer(index):
+            for _ in range(args.inserts):
+                started = perf_counter()
+                operation()
+                latencies[index].append(perf_counter() - started)
+        elapsed = run_threads(args.threads, writer)
+        values = [value for thread in latencies for value in thread]
+        print(f"  {label:<28} Mittel {sum(values) / len(values) * 1000:.2f} ms  "
+              f"p99 {percentile(values, 0.99) * 1000:.2f} ms  {len(values) / elapsed:.0f} Inserts/s")
+
+
+# Offene Bestellungen lesen, mit und ohne den partiellen Index idx_orders_open
+def seed_orders(module, count, open_share, bars=None):
+    # count Bestellungen über alle Bars verteilt, davon etwa open_share noch offen
+    bars = bars or [(bar, drinks) for bar, drinks in module.BARS.items() if drinks]
+    rows = []
+    for index in range(count):
+        bar, drinks = bars[index % len(bars)]
+        status = "offen" if index % round(1 / open_share) == 0 else "entsandt"
+        rows.append((bar, "bar", drinks[index // len(bars) % len(drinks)], 1 + index % 5, status))
+    conn = sqlite3.connect(module.DB_FILE)
+    conn.executemany("INSERT INTO orders (username, role, drink, quantity, status) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+def mean_seconds(repeat, func, *args):
+    started = perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (perf_counter() - started) / repeat
+
+@benchmark("open-index", "Offene Bestellungen lesen, mit und ohne idx_orders_open")
+def bench_open_index(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    nachschub.setup()
+    seed_orders(nachschub, args.orders, 0.01)
+    open_count = len(nachschub.db_operation(nachschub.get_open_orders))
+    print(f"{args.orders} Bestellungen, davon {open_count} offen")
+    print(f"  mit Index     {mean_seconds(args.repeat, nachschub.db_operation, nachschub.get_open_orders) * 1000:.2f} ms")
+    nachschub.db_operation(lambda cursor: cursor.execute("DROP INDEX idx_orders_open"))
+    print(f"  ohne Index    {mean_seconds(args.repeat, nachschub.db_operation, nachschub.get_open_orders) * 1000:.2f} ms")
+
+
+# Ein Chat mit ausgeschöpftem Limit darf die Warteschlange für andere nicht aufhalten
+@benchmark("sender", "Wartezeit in der Sende-Warteschlange, wenn ein Chat sein Limit ausschöpft")
+def bench_sender(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    fake = FakeTelegramClient()
+    nachschub.apihelper.API_URL = fake.api_url
+    nachschub.setup()
+    nachschub.start_sender()
+    busy_chat, other_chats = 1, range(2, 2 + args.other_chats)
+    delivered = {}
+    def send(chat_id, text):
+        nachschub.bot.send_message(chat_id, text)
+        delivered.setdefault(chat_id, []).append(perf_counter())
+
+    started = perf_counter()
+    for number in range(args.burst):
+        nachschub.enqueue_send(None, send, busy_chat, f"Meldung {number}")
+    for chat_id in other_chats:
+        nachschub.enqueue_send(None, send, chat_id, "Meldung")
+    while sum(map(len, delivered.values())) < args.burst + len(other_chats):
+        sleep(0.01)
+
+    others = [delivered[chat_id][0] - started for chat_id in other_chats]
+    print(f"{args.burst} Meldungen an einen Chat (Limit {nachschub.CHAT_RATE_LIMIT}/s, Burst {nachschub.CHAT_BURST}), "
+          f"danach je eine an {len(other_chats)} andere Chats")
+    print(f"  andere Chats zugestellt nach höchstens {max(others) * 1000:.0f} ms")
+    print(f"  der volle Chat nach {(delivered[busy_chat][-1] - started):.1f} s")
+
+
+# Tastaturen bei jedem Aufruf bauen gegen die zwischengespeicherten JSON-Tastaturen
+@benchmark("keyboards", "Getränkemenüs und Kandidaten-Tastaturen bauen gegen Cache")
+def bench_keyboards(bots, data_dir, args):
+    nachschub, ball = bots["nachschub"], bots["ballkoenig"]
+    ball.setup()
+    repeat = args.repeat * 10
+
+    build = mean_seconds(repeat, nachschub.build_drink_menus) / len(nachschub.BARS)
+    bar = next(name for name, drinks in nachschub.BARS.items() if drinks)
+    cached = mean_seconds(repeat, nachschub.DRINK_MENUS.get, bar)
+    print(f"Getränkemenü ({len(nachschub.BARS)} Bars, pro Bar)")
+    print(f"  bauen         {build * 1e6:.1f} us")
+    print(f"  aus dem Cache {cached * 1e6:.2f} us")
+
+    query = ball.normalize_name(args.query)
+    ball.kandidaten_keyboard(query)
+    build = mean_seconds(repeat, ball.kandidaten_keyboard.__wrapped__, query)
+    cached = mean_seconds(repeat, ball.kandidaten_keyboard, query)
+    print(f"Kandidaten-Tastatur für '{args.query}' ({len(ball.kandidaten_index.search(query))} von "
+          f"{len(ball.kandidaten_data)} Kandidaten)")
+    print(f"  bauen         {build * 1e6:.1f} us")
+    print(f"  aus dem Cache {cached * 1e6:.2f} us")
+
+
+# Kandidatensuche über den Trigramm-Index gegen einen linearen Durchlauf
+SYLLABLES = [consonant + vowel for consonant in ("b", "ch", "d", "f", "g", "h", "k", "l", "m", "n", "p", "r",
+                                                 "s", "sch", "st", "t", "w", "z")
+             for vowel in ("a", "e", "i", "o", "u", "ä", "ö", "ü", "é")]
+
+def candidate_names(count, seed):
+    # Zufällige Vor- und Nachnamen aus Silben, mit Umlauten und Akzenten wie in kandidaten.json
+    rng = random.Random(seed)
+    word = lambda: "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+    names = set()
+    while len(names) < count:
+        names.add(f"{word()} {word()}")
+    return sorted(names)
+
+@benchmark("search", "Kandidatensuche mit Trigramm-Index gegen linearen Durchlauf")
+def bench_search(bots, data_dir, args):
+    ball = bots["ballkoenig"]
+    rng = random.Random(args.seed)
+    names = candidate_names(args.candidates, args.seed)
+    index = ball.KandidatenIndex([{"name": name} for name in names])
+    queries = []
+    for _ in range(args.repeat):
+        name = ball.normalize_name(rng.choice(names))
+        start = rng.randrange(len(name) - 3)
+        queries.append(name[start:start + 4])
+
+    variants = [
+        ("Trigramm-Index", index.search),
+        # Gleiches Ergebnis wie der Index, aber jeder Name wird angesehen
+        ("linear, normalisiert", lambda query: [name for name, forms in zip(index.names, index.forms)
+                                                if any(query in form for form in forms)]),
+        # Stand vorher: nur lower(), findet 'muller' nicht in 'Müller'
+        ("linear, lower()", lambda query: [name for name in names if query in name.lower()]),
+    ]
+    hits = sum(len(index.search(query)) for query in queries) / len(queries)
+    print(f"{len(names)} Kandidaten, {len(queries)} Suchen mit 4 Zeichen, im Mittel {hits:.0f} Treffer")
+    for label, search in variants:
+        started = perf_counter()
+        for query in queries:
+            search(query)
+        print(f"  {label:<22} {(perf_counter() - started) / len(queries) * 1e6:.0f} us pro Suche")
+
+
+# Speicherbedarf und Kosten des Gesprächszustands bei vielen gleichzeitigen Chats
+def start_conversations(store, chat_ids, drink, bar):
+    # Wie handle_order: Mengen-Schritt mit Getränk, Bar, Rolle und Nachfrage-Nachricht
+    for chat_id in chat_ids:
+        store.set_step(chat_id, "quantity", drink, bar, "bar", chat_id + 1)
+        store.add_message(chat_id, chat_id + 2)
+
+@benchmark("conversations", "Speicher und Kosten von 10k gleichzeitigen Gesprächen")
+def bench_conversations(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    nachschub.setup()
+    bar = next(name for name, drinks in nachschub.BARS.items() if drinks)
+    drink = nachschub.BARS[bar][0]
+    chats = args.chats
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = nachschub.botkern.ConversationStore(nachschub.database, nachschub.CONVERSATION_TTL, chats,
+                                                persistent=False)
+    start_conversations(store, range(chats), drink, bar)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{chats} Gespräche ohne Persistenz: {used / 2 ** 20:.1f} MiB, {used / chats:.0f} B pro Chat")
+
+    start_conversations(store, range(chats, chats + chats // 10), drink, bar)
+    oldest = min(store.entries)
+    print(f"  nach {chats // 10} weiteren Chats: {len(store.entries)} Einträge, ältester Chat {oldest}")
+
+    store = nachschub.botkern.ConversationStore(nachschub.database, nachschub.CONVERSATION_TTL, chats)
+    per_thread = chats // args.threads
+    elapsed = run_threads(args.threads, lambda index: start_conversations(
+        store, range(index * per_thread, (index + 1) * per_thread), drink, bar))
+    print(f"  mit Persistenz, {args.threads} Threads: {elapsed / (per_thread * args.threads) * 1e6:.0f} us pro Chat "
+          f"(Schritt setzen und Nachricht merken)")
+    restarted = nachschub.botkern.ConversationStore(nachschub.database, nachschub.CONVERSATION_TTL, chats)
+    started = perf_counter()
+    restarted.load()
+    print(f"  Laden nach Neustart: {len(restarted.entries)} Gespräche in {(perf_counter() - started) * 1000:.0f} ms, "
+          f"Chat 0 bei {restarted.current(0)[0]!r}")
+
+
+# Nachschub-Liste seitenweise statt aller offenen Bestellungen auf einmal
+def capture_dashboards(module):
+    # Statt zu senden nur die fertige Tastatur merken (samt Zustand wie render_dashboard):
+    # gemessen wird das Aufbauen der Liste
+    rendered = {}
+    def render_dashboard(chat_id, view, text, markup, state=None):
+        rendered[chat_id] = markup if isinstance(markup, str) else markup.to_json()
+        module.dashboard_messages[(chat_id, view)] = (1, text, rendered[chat_id])
+        module.dashboard_states[(chat_id, view)] = state
+    module.render_dashboard = render_dashboard
+    return rendered
+
+def rebuild(module, view, show, chat_id, *args):
+    # Zustand vergessen, damit die Ansicht sicher neu gebaut wird
+    module.dashboard_states.pop((chat_id, view), None)
+    show(chat_id, *args)
+
+def callback_query(module, chat_id, data):
+    return module.types.CallbackQuery.de_json({
+        "id": "1", "data": data, "chat_instance": str(chat_id),
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Nachschub"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": ""},
+    })
+
+def keyboard_callbacks(markup_json):
+    return [button["callback_data"] for row in json.loads(markup_json)["inline_keyboard"] for button in row]
+
+@benchmark("paging", "Offene Bestellungen seitenweise gegen alle auf einer Seite")
+def bench_paging(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    fake = FakeTelegramClient()
+    nachschub.apihelper.API_URL = fake.api_url
+    nachschub.setup()
+    seed_orders(nachschub, args.open_orders, 1.0)
+    nachschub.open_orders.load(nachschub.db_operation(nachschub.get_open_orders))
+    rendered = capture_dashboards(nachschub)
+    chat_id = 1
+
+    print(f"{args.open_orders} offene Bestellungen in {len(nachschub.open_orders.groups)} Gruppen")
+    for label, page_size in (("alle auf einer Seite", 10 ** 6), ("seitenweise", nachschub.OPEN_ORDERS_PAGE_SIZE)):
+        nachschub.OPEN_ORDERS_PAGE_SIZE = page_size
+        nachschub.open_orders_pages.pop(chat_id, None)
+        elapsed = mean_seconds(args.repeat, rebuild, nachschub, "open_orders", nachschub.show_open_orders_for_nachschub, chat_id)
+        buttons = len(keyboard_callbacks(rendered[chat_id]))
+        print(f"  {label:<21} {buttons:>4} Knöpfe, {len(rendered[chat_id].encode()) / 1024:5.1f} KB, "
+              f"{elapsed * 1000:.2f} ms pro Aufbau")
+
+    # Alle Seiten vorwärts und wieder zurück blättern
+    nachschub.open_orders_pages.pop(chat_id, None)
+    nachschub.show_open_orders_for_nachschub(chat_id)
+    first_page = rendered[chat_id]
+    pages = 1
+    for direction in ("page:from:", "page:before:"):
+        while True:
+            step = [data for data in keyboard_callbacks(rendered[chat_id]) if data.startswith(direction)]
+            if not step:
+                break
+            nachschub.handle_page(callback_query(nachschub, chat_id, step[0]))
+            pages += direction == "page:from:"
+    print(f"  {pages} Seiten vor und zurück, erste Seite danach "
+          f"{'identisch' if rendered[chat_id] == first_page else 'VERSCHIEDEN'}")
+
+
+# Listen aus den Bestellungen im Speicher bauen statt bei jeder Aktualisierung abzufragen.
+# Vorher lief pro Aktualisierung eine dieser Abfragen (mit einem Index, der inzwischen wieder
+# entfernt ist); das Bauen der Tastatur daraus kostet gleich viel wie jetzt aus dem Speicher.
+OPEN_GROUPS_QUERY = """
+SELECT username, drink, SUM(quantity), COUNT(*) FROM orders WHERE status = 'offen'
+GROUP BY username, drink ORDER BY username, drink LIMIT ?
+"""
+BAR_ORDERS_QUERY = "SELECT id AS order_id, username, drink, quantity, status FROM orders WHERE status = 'offen' AND username = ?"
+
+@benchmark("refresh", "Listen abfragen, aus dem Speicher bauen oder unverändert überspringen")
+def bench_refresh(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    fake = FakeTelegramClient()
+    nachschub.apihelper.API_URL = fake.api_url
+    nachschub.setup()
+    seed_orders(nachschub, args.open_orders, 1.0)
+    nachschub.open_orders.load(nachschub.db_operation(nachschub.get_open_orders))
+    nachschub.db_operation(lambda cursor: cursor.execute("""
+    CREATE INDEX idx_orders_open_groups ON orders (username, drink, quantity, status) WHERE status = 'offen'
+    """))
+    capture_dashboards(nachschub)
+    bar = next(name for name, drinks in nachschub.BARS.items() if drinks)
+    runner_chat, bar_chat = 1, 2
+    nachschub.login_session(bar_chat, bar, "bar")
+
+    views = [("Nachschub-Liste", "open_orders", nachschub.show_open_orders_for_nachschub, (runner_chat,),
+              (OPEN_GROUPS_QUERY, nachschub.OPEN_ORDERS_PAGE_SIZE + 1)),
+             ("Bar-Liste", "bar_orders", nachschub.show_bar_orders, (bar_chat, bar), (BAR_ORDERS_QUERY, bar))]
+    print(f"{args.open_orders} offene Bestellungen, davon {len(nachschub.open_orders.order_ids(bar))} für {bar}; "
+          f"{args.repeat} Aktualisierungen pro Variante")
+    for label, view, show, show_args, (query, *params) in views:
+        query_ms = mean_seconds(args.repeat, nachschub.db_operation,
+                                lambda cursor: cursor.execute(query, params).fetchall()) * 1000
+        from_memory_ms = mean_seconds(args.repeat, rebuild, nachschub, view, show, *show_args) * 1000
+        unchanged_ms = mean_seconds(args.repeat, show, *show_args) * 1000
+        print(f"  {label:<16} vorher (Abfrage + Aufbau) {query_ms + from_memory_ms:.3f} ms, "
+              f"aus dem Speicher {from_memory_ms:.3f} ms, unverändert {unchanged_ms:.3f} ms")
+
+
+# Spenden über das Ledger mit Group Commit gegen ein UPDATE pro Spende (Stand vorher)
+def update_punkte(cursor, name, punkte):
+    cursor.execute("UPDATE kandidaten SET punkte = punkte + ? WHERE name = ?", (punkte, name))
+
+def use_synchronous(module, mode):
+    # Jede neue Verbindung (auch die des Spenden-Writers) mit PRAGMA synchronous=mode
+    database = module.database
+    get_connection = database.connection
+    def connection():
+        conn = get_connection()
+        if getattr(database.local, "synchronous", None) != mode:
+            conn.execute(f"PRAGMA synchronous={mode}")
+            database.local.synchronous = mode
+        return conn
+    database.connection = connection
+
+@benchmark("donations", "Spenden pro Sekunde, Ledger mit Group Commit gegen UPDATE pro Spende")
+def bench_donations(bots, data_dir, args):
+    ball = bots["ballkoenig"]
+    ball.setup()
+    use_synchronous(ball, args.synchronous)
+    names = [kandidat["name"] for kandidat in ball.kandidaten_data]
+    per_cashier = args.donations
+
+    print(f"{per_cashier} Spenden pro Kasse, synchronous={args.synchronous}")
+    for cashiers in (1, args.cashiers):
+        results = []
+        for label, donate in (("UPDATE pro Spende", lambda name: ball.db_operation(update_punkte, name, 3)),
+                              ("Ledger, Group Commit", lambda name: ball.record_donation(name, 5, 3, 1, 1))):
+            latencies = [[] for _ in range(cashiers)]
+            batches = ball.metrics.counters.get("donation_batches", 0)
+            def cashier(index):
+                rng = random.Random(index)
+                for _ in range(per_cashier):
+                    started = perf_counter()
+                    donate(rng.choice(names))
+                    latencies[index].append(perf_counter() - started)
+            elapsed = run_threads(cashiers, cashier)
+            values = [value for thread in latencies for value in thread]
+            batches = ball.metrics.counters.get("donation_batches", 0) - batches
+            results.append(f"{label} {len(values) / elapsed:.0f}/s (p50 {percentile(values, 0.5) * 1000:.2f} ms"
+                           + (f", {batches} Batches)" if batches else ")"))
+        print(f"  {cashiers:>2} Kassen: " + ", ".join(results))
+
+    # Punkte = Ledger + die UPDATE-Läufe, die nicht im Ledger stehen (je 3 Punkte)
+    ledger = sum(total for _, total in ball.db_operation(ball.get_donation_totals))
+    punkte = sum(punkte for _, _, punkte in ball.db_operation(ball.get_all_punkte))
+    expected = ledger + 3 * per_cashier * (1 + args.cashiers)
+    print(f"  Ledger {ledger} Punkte, Kandidaten {punkte} Punkte: "
+          f"{'stimmt überein' if punkte == expected else f'ABWEICHUNG, erwartet {expected}'}")
+
+
+# Schreiblatenz, während eine Sicherung läuft
+def write_latencies_during(module, action, bar, drink):
+    # Ein Schreiber bestellt alle 2 ms; zurück kommen die Dauer von action und die Latenzen
+    # der Schreibvorgänge, die währenddessen begonnen haben
+    writes = []
+    stop = threading.Event()
+    def writer():
+        while not stop.is_set():
+            started = perf_counter()
+            module.db_operation(module.insert_order, bar, "bar", drink, 1)
+            writes.append((started, perf_counter() - started))
+            sleep(0.002)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    sleep(0.3)
+    started = perf_counter()
+    action()
+    finished = perf_counter()
+    stop.set()
+    thread.join()
+    return finished - started, [latency for at, latency in writes if started <= at <= finished]
+
+def one_shot_backup(module, path):
+    source = sqlite3.connect(module.DB_FILE)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+@benchmark("backup", "Schreiblatenz während einer Sicherung")
+def bench_backup(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    nachschub.setup()
+    seed_orders(nachschub, args.backup_rows, 0.01)
+    bar = next(name for name, drinks in nachschub.BARS.items() if drinks)
+    drink = nachschub.BARS[bar][0]
+    backups = nachschub.backups
+    export = backups.export or "csv"
+    def without_export():
+        backups.export = ""
+        backups.backup()
+        backups.export = export
+    variants = [("keine Sicherung", lambda: sleep(1.0)),
+                ("in einem Schritt", lambda: one_shot_backup(nachschub, os.path.join(data_dir, "einmal.db"))),
+                (f"schrittweise + {export}", backups.backup),
+                ("schrittweise ohne Export", without_export)]
+
+    print(f"orders.db {os.path.getsize(nachschub.DB_FILE) / 2 ** 20:.1f} MiB, {args.backup_rows} Bestellungen; "
+          f"ein Schreiber alle 2 ms")
+    for label, action in variants:
+        elapsed, latencies = write_latencies_during(nachschub, action, bar, drink)
+        print(f"  {label:<26} {elapsed * 1000:5.0f} ms, {len(latencies):4d} Schreibvorgänge, "
+              f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms, "
+              f"max {max(latencies) * 1000:.2f} ms")
+
+    snapshot = backups.snapshots()[-1]
+    conn = sqlite3.connect(snapshot)
+    print(f"  letzte Sicherung: integrity_check {conn.execute('PRAGMA integrity_check').fetchone()[0]}, "
+          f"journal_mode {conn.execute('PRAGMA journal_mode').fetchone()[0]}, "
+          f"{conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]} Bestellungen")
+    conn.close()
+
+
+# Durchsatz der Chat-Worker bei vielen gleichzeitig bestellenden Bars: jede Bar bestellt in
+# ihrem eigenen Chat nacheinander (Getränk antippen, Menge schicken), alle Bars gleichzeitig.
+# Die Bars sind erfunden und bekommen die Getränke der echten Bars der Reihe nach; die
+# Telegram-Limits sind aufgehoben, damit die Worker und nicht die Sende-Limits bremsen.
+BAR_COUNTS = (10, 50, 200)
+BAR_CHATS = 2 * 10 ** 6
+
+def add_bars(module, count):
+    drink_lists = [drinks for drinks in module.BARS.values() if drinks]
+    names = [f"Testbar {number}" for number in range(1, count + 1)]
+    for index, name in enumerate(names):
+        module.BARS[name] = drink_lists[index % len(drink_lists)]
+        module.USERS[name] = {"role": "bar", "password": name}
+        module.BAR_INDEX[name] = len(module.BAR_NAMES)
+        module.BAR_NAMES.append(name)
+    module.build_drink_menus()
+    return names
+
+@benchmark("bars", "Updates pro Sekunde mit 10, 50 und 200 gleichzeitig bestellenden Bars")
+def bench_bars(bots, data_dir, args):
+    nachschub = bots["nachschub"]
+    fake = FakeTelegramClient()
+    nachschub.apihelper.API_URL = fake.api_url
+    nachschub.setup()
+    sender = nachschub.send_request
+    sender.global_bucket = nachschub.botkern.TokenBucket(10 ** 6, 10 ** 6)
+    sender.chat_rate = sender.chat_burst = 10 ** 6
+    names = add_bars(nachschub, max(BAR_COUNTS))
+    simulation = Simulation(bots, fake, 1, args.seed)
+    chat_ids = itertools.count(BAR_CHATS)
+
+    print(f"{args.bar_orders} Bestellungen pro Bar (je 2 Updates), {nachschub.WORKER_THREADS} Chat-Worker")
+    for count in BAR_COUNTS:
+        bars = [(next(chat_ids), name) for name in names[:count]]
+        for chat_id, name in bars:
+            nachschub.login_session(chat_id, name, "bar")
+        simulation.latencies["nachschub"] = []
+        def order(index):
+            chat_id, name = bars[index]
+            rng = random.Random(f"{args.seed}:{chat_id}")
+            for _ in range(args.bar_orders):
+                simulation.deliver("nachschub", chat_id, data=f"order:{rng.choice(nachschub.BARS[name])}")
+                simulation.deliver("nachschub", chat_id, str(rng.randint(1, 6)))
+        elapsed = run_threads(count, order)
+        latencies = simulation.latencies["nachschub"]
+        print(f"  {count:>3} Bars: {len(latencies) / elapsed:6.0f} Updates/s, "
+              f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+              + (f", {simulation.timeouts} Zeitüberschreitungen" if simulation.timeouts else ""))
+
+
+# Antwortzeit mit Webhook gegen Long Polling: /start aus jeweils einem neuen Chat, nacheinander,
+# gemessen vom Einliefern des Updates bis die sendMessage der Antwort bei der Fake-API ankommt.
+# Beim Polling holt der Bot das Update über getUpdates ab, beim Webhook kommt es per POST an
+# botkern.webhook_server. Das globale Limit ist aufgehoben, damit nur der Weg gemessen wird.
+WEBHOOK_CHATS = 10 ** 6
+WEBHOOK_SECRET = "bench"
+
+def start_update(update_id, chat_id):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "/start", "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"Gast {chat_id}"}}}
+
+def reply_latencies(fake, bot_name, updates, chat_ids, send):
+    latencies = []
+    for _ in range(updates):
+        chat_id = next(chat_ids)
+        started = monotonic()
+        send(start_update(chat_id, chat_id))
+        arrived = fake.reply_time(bot_name, chat_id)
+        if arrived is None:
+            raise RuntimeError(f"{bot_name}: keine Antwort in Chat {chat_id}")
+        latencies.append(arrived - started)
+    return latencies
+
+def post_update(url, update):
+    request = Request(url, data=json.dumps(update).encode(), method="POST", headers={
+        "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET})
+    with urlopen(request) as response:
+        response.read()
+
+@benchmark("webhook", "Antwortzeit über Webhook gegen Long Polling, vom Update bis zur Antwort")
+def bench_webhook(bots, data_dir, args):
+    fake = FakeTelegramClient()
+    chat_ids = itertools.count(WEBHOOK_CHATS)
+    print(f"{args.updates} Updates nacheinander pro Bot und Weg, /start aus je einem neuen Chat")
+    bots["nachschub"].apihelper.API_URL = fake.api_url
+    for module in bots.values():
+        module.setup()
+        module.send_request.global_bucket = module.botkern.TokenBucket(10 ** 6, 10 ** 6)
+
+    for bot_name, module in bots.items():
+        # Long Polling wie in run() ohne WEBHOOK_URL
+        threading.Thread(target=module.run, name=f"{bot_name}-polling", daemon=True).start()
+        deadline = monotonic() + 10
+        while TOKENS[bot_name] not in fake.first_polls() and monotonic() < deadline:
+            sleep(0.01)
+        polling = reply_latencies(fake, bot_name, args.updates, chat_ids, lambda update: fake.push(bot_name, update))
+        module.bot.stop_polling()
+
+        server = module.botkern.webhook_server(module.bot, "https://example.org/webhook", WEBHOOK_SECRET, 0)
+        threading.Thread(target=server.serve_forever, name=f"{bot_name}-webhook", daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/webhook"
+        webhook = reply_latencies(fake, bot_name, args.updates, chat_ids, lambda update: post_update(url, update))
+        server.shutdown()
+
+        for label, latencies in (("Long Polling", polling), ("Webhook", webhook)):
+            print(f"  {bot_name:<11} {label:<13} p50 {percentile(latencies, 0.5) * 1000:5.1f} ms, "
+                  f"p95 {percentile(latencies, 0.95) * 1000:5.1f} ms, p99 {percentile(latencies, 0.99) * 1000:5.1f} ms")
+
+
+# Beide Bots als zwei Prozesse gegen beide in einem Prozess über host.py: Zeit vom Start bis
+# beide Bots das erste getUpdates schicken, danach senden HOST_CHATS Chats /start an jeden Bot,
+# und wenn alle Antworten da sind, werden RSS und offene Sockets aller Bot-Prozesse gezählt.
+# Die Bots laufen unverändert als __main__; der Starter biegt nur die API-Adresse auf die
+# Fake-API um.
+HOST_CHATS = 60
+BOT_LAUNCHER = """
+import os, runpy, sys
+from telebot import apihelper
+apihelper.API_URL = sys.argv[1]
+sys.argv = sys.argv[2:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+HOST_LAYOUTS = {
+    "zwei Prozesse": [os.path.join(REPO_DIR, "NachschubBot", "nachschub.py"),
+                      os.path.join(REPO_DIR, "BallkoenigBot", "ball.py")],
+    "host.py": [os.path.join(REPO_DIR, "host.py")],
+}
+
+def process_usage(pid):
+    # RSS in MiB und Anzahl offener Sockets aus /proc
+    with open(f"/proc/{pid}/status") as status:
+        rss = next(int(line.split()[1]) for line in status if line.startswith("VmRSS:")) / 1024
+    sockets = 0
+    for fd in os.listdir(f"/proc/{pid}/fd"):
+        try:
+            sockets += os.readlink(f"/proc/{pid}/fd/{fd}").startswith("socket:")
+        except FileNotFoundError:
+            pass
+    return rss, sockets
+
+def start_bots(scripts, data_dir):
+    fake = FakeTelegramClient()
+    env = dict(os.environ, NACHSCHUB_DB_FILE=os.path.join(data_dir, "orders.db"),
+               BALLKOENIG_DB_FILE=os.path.join(data_dir, "ballkoenig.db"), BACKUP_DIR=os.path.join(data_dir, "backups"))
+    started = monotonic()
+    processes = [subprocess.Popen([sys.executable, "-c", BOT_LAUNCHER, fake.api_url, script], env=env,
+                                  stdout=subprocess.DEVNULL) for script in scripts]
+    deadline = started + 30
+    polls = {}
+    while len(polls) < len(TOKENS) and monotonic() < deadline:
+        polls = fake.first_polls()
+        sleep(0.005)
+    if len(polls) < len(TOKENS):
+        raise RuntimeError(f"kein getUpdates von {set(TOKENS.values()) - set(polls)}")
+    return fake, processes, max(polls.values()) - started
+
+@benchmark("host", "Kaltstart, Speicher und Sockets: zwei Bot-Prozesse gegen host.py")
+def bench_host(bots, data_dir, args):
+    print(f"{HOST_CHATS} Chats senden /start an jeden Bot; Median aus {args.runs} Läufen")
+    results = {layout: [] for layout in HOST_LAYOUTS}
+    for run in range(args.runs):
+        for layout, scripts in HOST_LAYOUTS.items():
+            run_dir = tempfile.mkdtemp(prefix=f"lauf-{run}-", dir=data_dir)
+            fake, processes, cold_start = start_bots(scripts, run_dir)
+            try:
+                for bot_name in TOKENS:
+                    for chat_id in range(1, HOST_CHATS + 1):
+                        fake.push(bot_name, start_update(chat_id, chat_id))
+                for bot_name in TOKENS:
+                    for chat_id in range(1, HOST_CHATS + 1):
+                        if fake.reply_time(bot_name, chat_id, 30) is None:
+                            raise RuntimeError(f"{bot_name}: keine Antwort in Chat {chat_id}")
+                usage = [process_usage(process.pid) for process in processes]
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+            results[layout].append((cold_start, sum(rss for rss, _ in usage), sum(sockets for _, sockets in usage)))
+
+    for layout, runs in results.items():
+        cold_start, rss, sockets = (statistics.median(values) for values in zip(*runs))
+        print(f"  {layout:<14} {cold_start * 1000:4.0f} ms bis zum ersten getUpdates, {rss:5.1f} MiB RSS, "
+              f"{sockets:.0f} offene Sockets")
+
+
+def run_benchmark(name, args):
+    data_dir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        bots = load_bots(data_dir, 1)
+        BENCHMARKS[name][0](bots, data_dir, args)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks zu einzelnen Optimierungen")
+    parser.add_argument("name", nargs="?", choices=sorted(BENCHMARKS) + ["all"])
+    parser.add_argument("--list", action="store_true", help="Benchmarks auflisten")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--inserts", type=int, default=300)
+    parser.add_argument("--orders", type=int, default=50000, help="Bestellungen in der Datenbank")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=10, help="Meldungen an denselben Chat")
+    parser.add_argument("--other-chats", type=int, default=5)
+    parser.add_argument("--query", default="a", help="Suchbegriff für die Kandidatensuche")
+    parser.add_argument("--candidates", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--open-orders", type=int, default=3000)
+    parser.add_argument("--cashiers", type=int, default=16)
+    parser.add_argument("--donations", type=int, default=50, help="Spenden pro Kasse")
+    parser.add_argument("--synchronous", default="FULL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument("--backup-rows", type=int, default=300000, help="Bestellungen vor der Sicherung")
+    parser.add_argument("--updates", type=int, default=300, help="Updates pro Bot und Weg (webhook)")
+    parser.add_argument("--runs", type=int, default=3, help="Läufe pro Variante (host)")
+    parser.add_argument("--bar-orders", type=int, default=10, help="Bestellungen pro Bar (bars)")
+    args = parser.parse_args()
+
+    if args.list or not args.name:
+        for name, (_, description) in sorted(BENCHMARKS.items()):
+            print(f"{name:<14} {description}")
+        return 0
+    if args.name != "all":
+        run_benchmark(args.name, args)
+        return 0
+    # Jeder Benchmark in einem eigenen Prozess, damit sich Module und Datenbanken nicht teilen
+    failed = 0
+    for name, (_, description) in sorted(BENCHMARKS.items()):
+        print(f"== {name}: {description}", flush=True)
+        failed += subprocess.call([sys.executable, os.path.abspath(__file__), name] + sys.argv[2:]) != 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
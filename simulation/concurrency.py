@@ -0,0 +1,126 @@
+# Nebenläufigkeitstest für das Absenden offener Bestellungen: mehrere Nachschub-Läufer tippen
+# gleichzeitig auf denselben "absenden"-Knopf (process_group, process_bar und in jeder zweiten
+# Runde process_order für eine einzelne Bestellung; alles endet im Compare-and-set in
+# mark_orders_sent). Pro Runde wird eine frische Gruppe bestellt; danach muss jede Bestellung
+# genau ein "sent"-Ereignis haben und die Bar genau eine Meldung bekommen. Läuft gegen die
+# Fake-Telegram-API aus simulate.py; bei einer Abweichung endet der Test mit Exit-Code 1.
+#
+#   python simulation/concurrency.py
+#   python simulation/concurrency.py --threads 32 --rounds 50
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+from simulate import FakeTelegramClient, TOKENS, load_bots, wait_until_quiet
+
+ORDERS_PER_ROUND = 3
+BAR_CHAT_ID = 500
+RUNNER_CHAT_IDS = 600
+SPEED = 10  # Telegram-Limits und Sammelfenster wie in simulate.py verkürzen
+
+
+def callback(module, chat_id, data, update_id):
+    return module.types.CallbackQuery.de_json({
+        "id": str(update_id), "data": data, "chat_instance": str(chat_id),
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"Läufer {chat_id}"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": ""},
+    })
+
+def sent_events(module):
+    rows = module.db_operation(lambda cursor: cursor.execute(
+        "SELECT order_id, COUNT(*) FROM order_events WHERE event = 'sent' GROUP BY order_id").fetchall())
+    return dict(rows)
+
+def bar_notifications(fake, chat_id):
+    # Gesammelte Meldungen enthalten eine Zeile pro Absendung, einzelne genau eine
+    messages = fake.control("messages", token=TOKENS["nachschub"], chat_id=chat_id)
+    return sum(text.count("Bestellung von") for _, text, _ in messages if "abgesendet" in text)
+
+def run(threads, rounds):
+    fake = FakeTelegramClient()
+    data_dir = tempfile.mkdtemp(prefix="nebenlaeufig-")
+    nachschub = load_bots(data_dir, SPEED)["nachschub"]
+    nachschub.apihelper.API_URL = fake.api_url
+    nachschub.setup()
+    nachschub.start_services()
+
+    bar = next(name for name in nachschub.BAR_NAMES if nachschub.BARS[name])
+    drink = nachschub.BARS[bar][0]
+    runner = next(name for name, user in nachschub.USERS.items() if user["role"] == "nachschub")
+    nachschub.login_session(BAR_CHAT_ID, bar, "bar")
+    for index in range(threads):
+        nachschub.login_session(RUNNER_CHAT_IDS + index, runner, "nachschub")
+
+    failures = []
+    started = monotonic()
+    for number in range(rounds):
+        # In jeder zweiten Runde nur eine Bestellung, damit auch process_order dieselbe trifft
+        single = number % 2 == 1
+        nachschub.db_operation(nachschub.insert_orders, bar, "bar", [(drink, 1)] * (1 if single else ORDERS_PER_ROUND))
+        key = nachschub.group_key(bar, drink)
+        order_ids = nachschub.open_orders.order_ids(bar, drink)
+        before = sent_events(nachschub)
+
+        # Alle Läufer starten gleichzeitig; abwechselnd Gruppe, ganze Bar und einzelne
+        # Bestellung, alles trifft dieselben Bestellungen
+        taps = [(nachschub.process_orders_bulk, f"process_group:{key}"),
+                (nachschub.process_orders_bulk, f"process_bar:{key}")]
+        if single:
+            taps.append((nachschub.process_order, f"process_order:{order_ids[0]}"))
+        barrier = threading.Barrier(threads)
+        def tap(index):
+            handler, data = taps[index % len(taps)]
+            call = callback(nachschub, RUNNER_CHAT_IDS + index, data, number * threads + index)
+            barrier.wait()
+            handler(call)
+        workers = [threading.Thread(target=tap, args=(index,)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        after = sent_events(nachschub)
+        wrong = {order_id: after.get(order_id, 0) - before.get(order_id, 0) for order_id in order_ids}
+        wrong = {order_id: n for order_id, n in wrong.items() if n != 1}
+        if wrong:
+            failures.append(f"Runde {number + 1}: 'sent'-Ereignisse pro Bestellung {wrong}")
+        if nachschub.open_orders.order_ids(bar):
+            failures.append(f"Runde {number + 1}: Bestellungen noch offen")
+
+    # Meldungen laufen über das Sammelfenster und die Sende-Warteschlange
+    deadline = monotonic() + 10
+    while nachschub.pending_notifications and monotonic() < deadline:
+        sleep(0.05)
+    wait_until_quiet({"nachschub": nachschub}, fake)
+    notifications = bar_notifications(fake, BAR_CHAT_ID)
+    if notifications != rounds:
+        failures.append(f"{notifications} Meldungen an die Bar statt {rounds}")
+    db_errors = nachschub.metrics.counters.get("db_errors", 0)
+    if db_errors:
+        failures.append(f"{db_errors} Datenbankfehler")
+
+    print(f"{rounds} Runden mit je {threads} gleichzeitigen Läufern und {ORDERS_PER_ROUND} bzw. 1 Bestellungen "
+          f"in {monotonic() - started:.1f} s: {sum(sent_events(nachschub).values())} 'sent'-Ereignisse, "
+          f"{notifications} Meldungen an die Bar")
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Gleichzeitiges Absenden derselben Bestellungen")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    failures = run(args.threads, args.rounds)
+    for failure in failures:
+        print(f"FEHLER: {failure}")
+    if not failures:
+        print("Jede Bestellung genau einmal abgesendet, jede Runde genau eine Meldung.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
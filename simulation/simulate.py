@@ -0,0 +1,621 @@
+# Simulierter Ballabend für beide Bots: treibt die echten Handler aus nachschub.py und ball.py
+# (über host.py, also wie im gemeinsamen Container) gegen eine lokale Fake-Telegram-API.
+# Der Ablauf ist per Seed reproduzierbar: Bars loggen sich ein und bestellen über den Abend,
+# in der Pause kommt eine Bestellwelle, Nachschub-Läufer arbeiten die offene Liste ab, an den
+# Kassen kommen Spendenwellen und Gäste schauen auf die Rangliste. Der Abend läuft um --speed
+# beschleunigt; Wartezeiten, Sammelfenster und Telegram-Limits werden im selben Maß verkürzt.
+#
+# Ausgegeben werden pro Bot p50/p95/p99 der Handler-Latenz (vom Eintreffen des Updates bis
+# der Handler fertig ist), Telegram-Aufrufe, DB-Zeit und Dateizugriffe pro Update sowie der
+# Speicher-Peak. Dateizugriffe werden pro Handler gezählt; ein Handler, der bei jedem Aufruf
+# eine Datei liest (z.B. json.load der Kandidaten), fällt damit auch ohne messbare Latenz auf.
+# Liegt ein Wert über simulation/baseline.json plus Toleranz, endet der Lauf mit Exit-Code 1.
+#
+#   python simulation/simulate.py                    # Lauf gegen die Baseline
+#   python simulation/simulate.py --seed 7 --speed 20
+#   python simulation/simulate.py --update-baseline  # aktuelle Werte als Baseline speichern
+import argparse
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from urllib.parse import parse_qsl, urlencode, urlparse
+from urllib.request import urlopen
+
+SIMULATION_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIMULATION_DIR)
+BASELINE_FILE = os.path.join(SIMULATION_DIR, "baseline.json")
+TOKENS = {"nachschub": "1001:simulation", "ballkoenig": "1002:simulation"}
+BOTS = tuple(TOKENS)
+
+RUNNERS = 3
+CASHIERS = 6
+VIEWERS = 10
+HANDLER_TIMEOUT = 30  # Sekunden; länger gilt als hängender Handler
+USER_MESSAGE_IDS = 10 ** 9  # eigener Bereich, damit Bot- und Benutzernachrichten nie kollidieren
+
+# Erlaubte Abweichung nach oben, relativ zur Baseline; Latenzen zusätzlich absolut in ms,
+# damit Rauschen im Sub-Millisekundenbereich keinen Fehlalarm auslöst
+TOLERANCE = {"p50_ms": 0.5, "p95_ms": 0.5, "p99_ms": 1.0, "api_calls_per_update": 0.1,
+             "db_ms_per_update": 1.0, "file_opens_per_update": 0.0, "peak_rss_mib": 0.25}
+LATENCY_SLACK_MS = 2.0
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Beendete Bot-Prozesse kappen ihre offenen Long Polls; das ist kein Fehler der Fake-API
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeTelegram:
+    """Beantwortet die Bot-API-Aufrufe beider Bots und merkt sich die Nachrichten samt Knöpfen
+    pro Chat, damit die simulierten Benutzer darauf tippen können. Läuft in einem eigenen
+    Prozess (wie das echte Telegram nicht im Bot-Prozess); die Simulation fragt den Zustand
+    über /simulation/... ab. Für Long Polling hält getUpdates die Anfrage offen, bis über
+    /simulation/push ein Update eingereiht wird. Zeitpunkte sind monotonic(); unter Linux ist
+    das dieselbe Uhr wie in den anderen Prozessen."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.message_ids = itertools.count(1)
+        self.messages = {}  # (Token, chat_id, message_id) -> (Text, [Knopf, ...])
+        self.calls = {}     # Token -> {Methode: Anzahl}
+        self.last_call = monotonic()
+        self.updates = {}   # Token -> [Update, ...] für das nächste getUpdates
+        self.polled = {}    # Token -> Zeitpunkt des ersten getUpdates
+        self.replies = {}   # (Token, chat_id) -> Zeitpunkt der ersten sendMessage
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    params.update(parse_qsl(self.rfile.read(length).decode("utf-8")))
+                if url.path.startswith("/simulation/"):
+                    result = fake.control(url.path[len("/simulation/"):], params)
+                else:
+                    token, method = url.path.split("/bot", 1)[1].split("/", 1)
+                    result = {"ok": True, "result": fake.answer(token, method, params)}
+                body = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = FakeTelegramServer(("127.0.0.1", 0), Handler)
+
+    def answer(self, token, method, params):
+        chat_id = int(params.get("chat_id", 0))
+        with self.lock:
+            calls = self.calls.setdefault(token, {})
+            calls[method] = calls.get(method, 0) + 1
+            if method == "getUpdates":
+                return self.get_updates(token, float(params.get("timeout", 0)))
+            self.last_call = monotonic()
+            if method == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "Simulation", "username": "simulation_bot"}
+            if method == "deleteMessage":
+                self.messages.pop((token, chat_id, int(params.get("message_id", 0))), None)
+                return True
+            if method == "sendMessage":
+                message_id = next(self.message_ids)
+                self.replies.setdefault((token, chat_id), monotonic())
+                self.changed.notify_all()
+            elif method in ("editMessageText", "editMessageReplyMarkup"):
+                message_id = int(params.get("message_id", 0))
+                if (token, chat_id, message_id) not in self.messages:
+                    return True
+            else:
+                return True
+            text = params.get("text", self.messages.get((token, chat_id, message_id), ("", []))[0])
+            self.messages[(token, chat_id, message_id)] = (text, buttons(params.get("reply_markup")))
+        return {"message_id": message_id, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def get_updates(self, token, timeout):
+        # Aufruf mit gehaltenem Lock; wait() gibt ihn frei, solange nichts anliegt
+        self.polled.setdefault(token, monotonic())
+        deadline = monotonic() + timeout
+        while not self.updates.get(token) and monotonic() < deadline:
+            self.changed.wait(deadline - monotonic())
+        return self.updates.pop(token, [])
+
+    def control(self, command, params):
+        with self.lock:
+            if command == "messages":
+                chat_id = int(params["chat_id"])
+                return [(message_id, text, keys) for (token, chat, message_id), (text, keys) in self.messages.items()
+                        if token == params["token"] and chat == chat_id]
+            if command == "calls":
+                calls, self.calls = self.calls, {}
+                return calls
+            if command == "idle":
+                return monotonic() - self.last_call
+            if command == "push":
+                self.updates.setdefault(params["token"], []).append(json.loads(params["update"]))
+                self.changed.notify_all()
+                return True
+            if command == "reply":
+                key = (params["token"], int(params["chat_id"]))
+                deadline = monotonic() + float(params.get("timeout", 10))
+                while key not in self.replies and monotonic() < deadline:
+                    self.changed.wait(deadline - monotonic())
+                return self.replies.get(key)
+            if command == "polled":
+                return self.polled
+
+def serve_fake_telegram(connection):
+    fake = FakeTelegram()
+    connection.send(fake.server.server_port)
+    fake.server.serve_forever()
+
+
+class FakeTelegramClient:
+    def __init__(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=serve_fake_telegram, args=(sender,), name="fake-telegram", daemon=True)
+        self.process.start()
+        port = receiver.recv()
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.api_url = f"{self.base_url}/bot{{0}}/{{1}}"
+        self.message_ids = itertools.count(USER_MESSAGE_IDS)
+
+    def control(self, command, **params):
+        with urlopen(f"{self.base_url}/simulation/{command}?{urlencode(params)}") as response:
+            return json.load(response)
+
+    def find(self, bot_name, chat_id, predicate, timeout=2.0):
+        # Neueste Nachricht im Chat, auf die predicate(Text, Knöpfe) zutrifft; wartet kurz,
+        # weil Listen teils erst über die Sende-Warteschlange aktualisiert werden
+        deadline = monotonic() + timeout
+        while True:
+            matches = [(message_id, text, keys) for message_id, text, keys
+                       in self.control("messages", token=TOKENS[bot_name], chat_id=chat_id) if predicate(text, keys)]
+            if matches:
+                return max(matches)
+            if monotonic() >= deadline:
+                return None
+            sleep(0.02)
+
+    def take_calls(self):
+        return self.control("calls")
+
+    def push(self, bot_name, update):
+        # Update für das nächste getUpdates des Bots
+        self.control("push", token=TOKENS[bot_name], update=json.dumps(update))
+
+    def reply_time(self, bot_name, chat_id, timeout=10):
+        # Wann die erste Antwort (sendMessage) in diesem Chat ankam; None nach timeout Sekunden
+        return self.control("reply", token=TOKENS[bot_name], chat_id=chat_id, timeout=timeout)
+
+    def first_polls(self):
+        # Token -> Zeitpunkt des ersten getUpdates
+        return self.control("polled")
+
+    def idle_for(self):
+        return self.control("idle")
+
+
+def open_orders_list(text, keys):
+    return text.startswith("📋")
+
+def buttons(reply_markup):
+    # Inline-Knöpfe als Callback-Daten, Antwort-Tastaturen als Text
+    if not reply_markup:
+        return []
+    markup = json.loads(reply_markup)
+    rows = markup.get("inline_keyboard") or markup.get("keyboard") or []
+    return [button.get("callback_data") or button.get("text") for row in rows for button in row]
+
+
+def load_bots(data_dir, speed):
+    os.environ.update({
+        "NACHSCHUB_BOT_KEY": TOKENS["nachschub"],
+        "BALLKOENIG_BOT_KEY": TOKENS["ballkoenig"],
+        "NACHSCHUB_DB_FILE": os.path.join(data_dir, "orders.db"),
+        "BALLKOENIG_DB_FILE": os.path.join(data_dir, "ballkoenig.db"),
+        "BACKUP_DIR": os.path.join(data_dir, "backups"),
+        "BACKUP_INTERVAL": "0",
+        "METRICS_PORT": "0",
+        "METRICS_LOG_INTERVAL": "0",
+    })
+    sys.path.insert(0, REPO_DIR)
+    import host
+
+    # Sammelfenster und Telegram-Limits auf die beschleunigte Zeit umrechnen
+    host.nachschub.NOTIFY_WINDOW_MS = max(1, host.nachschub.NOTIFY_WINDOW_MS // speed)
+    host.ball.LIVE_UPDATE_INTERVAL_MS = max(1, host.ball.LIVE_UPDATE_INTERVAL_MS // speed)
+    for module in (host.nachschub, host.ball):
+        sender = module.send_request
+        sender.global_bucket = module.botkern.TokenBucket(module.GLOBAL_RATE_LIMIT * speed, module.GLOBAL_RATE_LIMIT)
+        sender.chat_rate *= speed
+    return {"nachschub": host.nachschub, "ballkoenig": host.ball}
+
+
+# Ablauf des Abends: pro simuliertem Benutzer eine Liste (Sekunde, Aktion). Hängt nur von
+# Seed, Länge und Konfiguration ab, nicht vom Verlauf des Laufs.
+def short_names(drinks):
+    # Kurzname (erstes Wort) für Textbestellungen, nur wo er an der Bar eindeutig ist
+    first_words = [drink.split()[0] for drink in drinks]
+    return {drink: word for drink, word in zip(drinks, first_words) if first_words.count(word) == 1}
+
+def order_action(rng, drinks):
+    kind = rng.choices(("single", "cart", "text"), weights=(5, 3, 2))[0]
+    if kind == "single":
+        return ("order", rng.choice(drinks), rng.randint(1, 6))
+    picks = rng.sample(range(len(drinks)), min(len(drinks), rng.randint(2, 3)))
+    if kind == "cart":
+        return ("cart", [(index, rng.randint(1, 3)) for index in picks])
+    names = short_names(drinks)
+    items = [f"{names[drinks[index]]} {rng.randint(1, 6)}" for index in picks if drinks[index] in names]
+    if not items:
+        return ("order", rng.choice(drinks), rng.randint(1, 6))
+    return ("text", "; ".join(items))
+
+def spaced(rng, start, end, low, high):
+    at = start + rng.uniform(0, high)
+    while at < end:
+        yield at
+        at += rng.uniform(low, high)
+
+def build_script(seed, minutes, users, bars, kandidaten):
+    rng = random.Random(seed)
+    night = minutes * 60
+    pause_start, pause_end = night * 0.5, night * 0.5 + min(300, night * 0.2)
+    finale = night * 0.8
+    actors = []
+    chat_ids = itertools.count(1000)
+
+    for username, user in users.items():
+        drinks = bars.get(username, [])
+        if user["role"] != "bar" or not drinks:
+            continue
+        actions = [(rng.uniform(0, 60), ("login", username, user["password"]))]
+        actions += [(at, order_action(rng, drinks)) for at in spaced(rng, 120, pause_start, 60, 240)]
+        actions += [(at, order_action(rng, drinks)) for at in spaced(rng, pause_start, pause_end, 5, 30)]
+        actions += [(at, order_action(rng, drinks)) for at in spaced(rng, pause_end, night, 90, 300)]
+        actors.append(("nachschub", next(chat_ids), actions))
+
+    runner = next(name for name, user in users.items() if user["role"] == "nachschub")
+    for _ in range(RUNNERS):
+        actions = [(rng.uniform(0, 60), ("login", runner, users[runner]["password"]))]
+        for at in spaced(rng, 90, night + 60, 8, 25):
+            kind = rng.choices(("fulfil", "fulfil_bar", "select", "page"), weights=(13, 3, 2, 2))[0]
+            actions.append((at, (kind,)))
+        actors.append(("nachschub", next(chat_ids), actions))
+
+    for _ in range(CASHIERS):
+        actions = [(rng.uniform(0, 60), ("start",))]
+        moments = list(spaced(rng, 60, night, 60, 180)) + list(spaced(rng, pause_start, pause_end, 10, 25)) \
+            + list(spaced(rng, finale, night, 8, 20))
+        for at in sorted(moments):
+            label = rng.choice(("2 Euro (1 Punkt)", "5 Euro (3 Punkte)"))
+            actions.append((at, ("donation", label, rng.randint(1, 10), rng.choice(kandidaten))))
+        actors.append(("ballkoenig", next(chat_ids), actions))
+
+    for _ in range(VIEWERS):
+        actions = [(rng.uniform(0, 120), ("start",))]
+        actions += [(at, ("top",)) for at in spaced(rng, 120, night, 120, 600)]
+        if rng.random() < 0.3:
+            actions.append((rng.uniform(pause_start, night), ("live",)))
+        actors.append(("ballkoenig", next(chat_ids), sorted(actions)))
+    return actors
+
+
+class Simulation:
+    def __init__(self, bots, fake, speed, seed):
+        self.bots = bots
+        self.fake = fake
+        self.speed = speed
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.update_ids = itertools.count(1)
+        self.latencies = {name: [] for name in BOTS}
+        self.timeouts = 0
+
+    def deliver(self, bot_name, chat_id, text=None, data=None, message_id=None):
+        # Ein Update wie vom Webhook zustellen und warten, bis der Handler fertig ist: danach
+        # reiht sich ein Marker in dieselbe Chat-Warteschlange ein
+        module = self.bots[bot_name]
+        user = {"id": chat_id, "is_bot": False, "first_name": f"Gast {chat_id}"}
+        chat = {"id": chat_id, "type": "private"}
+        update_id = next(self.update_ids)
+        if data is None:
+            payload = {"message": {"message_id": next(self.fake.message_ids), "date": 0, "chat": chat,
+                                   "from": user, "text": text}}
+        else:
+            message = {"message_id": message_id or 0, "date": 0, "chat": chat, "text": ""}
+            payload = {"callback_query": {"id": str(update_id), "from": user, "message": message,
+                                          "chat_instance": str(chat_id), "data": data}}
+        update = module.types.Update.de_json({"update_id": update_id, **payload})
+        done = threading.Event()
+        started = monotonic()
+        module.bot.process_new_updates([update])
+        module.bot.pool.submit(module.bot, module.botkern.update_chat_id(update.message or update.callback_query),
+                               done.set, (), {})
+        finished = done.wait(HANDLER_TIMEOUT)
+        with self.lock:
+            self.latencies[bot_name].append(monotonic() - started)
+            self.timeouts += not finished
+
+    def tap(self, bot_name, chat_id, predicate, candidates, rng=None):
+        # Auf einen der Knöpfe candidates(keys) der neuesten passenden Nachricht tippen, mit rng
+        # zufällig, sonst den ersten; False, wenn es keinen gibt
+        found = self.fake.find(bot_name, chat_id, lambda text, keys: predicate(text, keys) and candidates(keys))
+        if not found:
+            return False
+        message_id, _, keys = found
+        choices = candidates(keys)
+        self.deliver(bot_name, chat_id, data=rng.choice(choices) if rng else choices[0], message_id=message_id)
+        return True
+
+    def run_actor(self, bot_name, chat_id, actions, started):
+        rng = random.Random(f"{self.seed}:{chat_id}")
+        for at, action in actions:
+            delay = started + at / self.speed - monotonic()
+            if delay > 0:
+                sleep(delay)
+            getattr(self, f"do_{action[0]}")(bot_name, chat_id, rng, *action[1:])
+
+    # Bars
+    def do_login(self, bot_name, chat_id, rng, username, password):
+        self.deliver(bot_name, chat_id, "/start")
+        self.deliver(bot_name, chat_id, f"/login {username} {password}")
+
+    def do_order(self, bot_name, chat_id, rng, drink, quantity):
+        menu = lambda text, keys: any(key.startswith("order:") for key in keys)
+        if self.tap(bot_name, chat_id, menu, lambda keys: [key for key in keys if key == f"order:{drink}"]):
+            self.deliver(bot_name, chat_id, str(quantity))
+
+    def do_cart(self, bot_name, chat_id, rng, items):
+        menu = lambda text, keys: "cart:open" in keys
+        if not self.tap(bot_name, chat_id, menu, lambda keys: ["cart:open"]):
+            return
+        cart = lambda text, keys: "cart:submit" in keys
+        for index, taps in items:
+            for _ in range(taps):
+                self.tap(bot_name, chat_id, cart, lambda keys: [f"cart:add:{index}"])
+        self.tap(bot_name, chat_id, cart, lambda keys: ["cart:submit"])
+
+    def do_text(self, bot_name, chat_id, rng, order_text):
+        self.deliver(bot_name, chat_id, order_text)
+        self.tap(bot_name, chat_id, lambda text, keys: "cart:submit" in keys, lambda keys: ["cart:submit"])
+
+    # Nachschub-Läufer
+    def do_fulfil(self, bot_name, chat_id, rng):
+        self.tap(bot_name, chat_id, open_orders_list, lambda keys: [key for key in keys if key.startswith("process_group:")], rng)
+
+    def do_fulfil_bar(self, bot_name, chat_id, rng):
+        self.tap(bot_name, chat_id, open_orders_list, lambda keys: [key for key in keys if key.startswith("process_bar:")], rng)
+
+    def do_select(self, bot_name, chat_id, rng):
+        if not self.tap(bot_name, chat_id, open_orders_list,
+                        lambda keys: ["select:start"] if any(key.startswith("process_group:") for key in keys) else []):
+            return
+        found = self.fake.find(bot_name, chat_id, lambda text, keys: open_orders_list(text, keys) and "select:submit" in keys)
+        if not found:
+            return
+        toggles = [key for key in found[2] if key.startswith("select:toggle:")]
+        for key in rng.sample(toggles, min(len(toggles), rng.randint(1, 3))):
+            self.deliver(bot_name, chat_id, data=key, message_id=found[0])
+        self.deliver(bot_name, chat_id, data="select:submit", message_id=found[0])
+
+    def do_page(self, bot_name, chat_id, rng):
+        self.tap(bot_name, chat_id, open_orders_list, lambda keys: [key for key in keys if key.startswith("page:from:")])
+
+    # Kassen und Gäste
+    def do_start(self, bot_name, chat_id, rng):
+        self.deliver(bot_name, chat_id, "/start")
+
+    def do_donation(self, bot_name, chat_id, rng, label, anzahl, name):
+        self.deliver(bot_name, chat_id, "Spende hinzufügen")
+        self.deliver(bot_name, chat_id, label)
+        self.deliver(bot_name, chat_id, str(anzahl))
+        self.deliver(bot_name, chat_id, name.split()[0])
+        self.deliver(bot_name, chat_id, name)
+
+    def do_top(self, bot_name, chat_id, rng):
+        self.deliver(bot_name, chat_id, self.bots[bot_name].TOP_BUTTON)
+
+    def do_live(self, bot_name, chat_id, rng):
+        self.deliver(bot_name, chat_id, self.bots[bot_name].LIVE_SUBSCRIBE_BUTTON)
+
+
+class FileOpens:
+    """Zählt open() pro Handler und Gesprächsschritt (STEPS) über einen Audit-Hook. Zugeordnet
+    wird dem innersten Handler auf dem Stack; Importe (.py/.pyc/.so) zählen nicht mit."""
+
+    IMPORT_SUFFIXES = (".py", ".pyc", ".so")
+
+    def __init__(self, bots):
+        self.handlers = {}  # Code-Objekt -> (Bot, Handler)
+        for bot_name, module in bots.items():
+            functions = [handler["function"] for handlers in (module.bot.message_handlers, module.bot.callback_query_handlers)
+                         for handler in handlers]
+            for function in functions + list(getattr(module, "STEPS", {}).values()):
+                function = inspect.unwrap(function)
+                self.handlers[function.__code__] = (bot_name, function.__name__)
+        self.lock = threading.Lock()
+        self.counts = {}  # (Bot, Handler) -> Anzahl
+        self.active = False
+        sys.addaudithook(self.hook)
+
+    def hook(self, event, args):
+        if event != "open" or not self.active or str(args[0]).endswith(self.IMPORT_SUFFIXES):
+            return
+        frame = sys._getframe(1)
+        while frame and frame.f_code not in self.handlers:
+            frame = frame.f_back
+        if frame:
+            key = self.handlers[frame.f_code]
+            with self.lock:
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def by_handler(self, bot_name):
+        with self.lock:
+            return {handler: n for (name, handler), n in sorted(self.counts.items()) if name == bot_name}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def db_seconds(module):
+    with module.metrics.lock:
+        return sum(histogram.total for (name, _), histogram in module.metrics.histograms.items()
+                   if name == "db_seconds")
+
+def wait_until_quiet(bots, fake, quiet=1.5, timeout=30):
+    # Verzögerte Löschungen und gesammelte Benachrichtigungen noch abwarten
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        busy = bots["nachschub"].bot.pool.depth() or bots["nachschub"].outbound_jobs
+        if not busy and fake.idle_for() >= quiet:
+            return
+        sleep(0.1)
+
+def simulate(seed, minutes, speed):
+    fake = FakeTelegramClient()
+    data_dir = tempfile.mkdtemp(prefix="ballnacht-")
+    bots = load_bots(data_dir, speed)
+    bots["nachschub"].apihelper.API_URL = fake.api_url
+    for module in bots.values():
+        module.setup()
+        module.start_services()
+
+    nachschub, ball = bots["nachschub"], bots["ballkoenig"]
+    kandidaten = [kandidat["name"] for kandidat in ball.kandidaten_data]
+    actors = build_script(seed, minutes, nachschub.USERS, nachschub.BARS, kandidaten)
+    simulation = Simulation(bots, fake, speed, seed)
+
+    wait_until_quiet(bots, fake, quiet=0.2)
+    fake.take_calls()
+    db_before = {name: db_seconds(module) for name, module in bots.items()}
+    file_opens = FileOpens(bots)
+    file_opens.active = True
+    started = monotonic()
+    threads = [threading.Thread(target=simulation.run_actor, args=(bot_name, chat_id, actions, started),
+                                name=f"actor-{chat_id}") for bot_name, chat_id, actions in actors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wait_until_quiet(bots, fake)
+    elapsed = monotonic() - started
+    file_opens.active = False
+
+    calls = fake.take_calls()
+    report = {"scenario": {"seed": seed, "minutes": minutes, "speed": speed},
+              "seconds": round(elapsed, 1), "timeouts": simulation.timeouts}
+    for name, module in bots.items():
+        latencies = simulation.latencies[name]
+        updates = max(1, len(latencies))
+        opens = file_opens.by_handler(name)
+        report[name] = {
+            "updates": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "api_calls_per_update": round(sum(calls.get(TOKENS[name], {}).values()) / updates, 3),
+            "db_ms_per_update": round((db_seconds(module) - db_before[name]) * 1000 / updates, 3),
+            "file_opens_per_update": round(sum(opens.values()) / updates, 3),
+            "api_calls": dict(sorted(calls.get(TOKENS[name], {}).items())),
+            "file_opens": opens,
+        }
+    report["peak_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    scenario = report["scenario"]
+    print(f"Ballabend-Simulation: Seed {scenario['seed']}, {scenario['minutes']} Minuten "
+          f"in {report['seconds']} s (Faktor {scenario['speed']})")
+    print(f"{'Bot':<11}{'Updates':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'API/Update':>12}{'DB ms/Update':>14}"
+          f"{'Dateien/Update':>16}")
+    for name in BOTS:
+        row = report[name]
+        print(f"{name:<11}{row['updates']:>8}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+              f"{row['api_calls_per_update']:>12.3f}{row['db_ms_per_update']:>14.3f}{row['file_opens_per_update']:>16.3f}")
+    for name in BOTS:
+        print(f"{name} API-Aufrufe: " + ", ".join(f"{method} {n}" for method, n in report[name]["api_calls"].items()))
+        if report[name]["file_opens"]:
+            print(f"{name} Dateizugriffe: " + ", ".join(f"{handler} {n}" for handler, n in report[name]["file_opens"].items()))
+    print(f"Speicher-Peak: {report['peak_rss_mib']} MiB")
+
+def compare(report, baseline):
+    failures = []
+    if report["timeouts"]:
+        failures.append(f"{report['timeouts']} Handler nicht innerhalb von {HANDLER_TIMEOUT} s fertig")
+    rows = [(f"{name} {key}", report[name][key], baseline[name][key], key) for name in BOTS
+            for key in TOLERANCE if key in baseline[name]]
+    rows.append(("peak_rss_mib", report["peak_rss_mib"], baseline["peak_rss_mib"], "peak_rss_mib"))
+    for label, value, reference, key in rows:
+        limit = reference * (1 + TOLERANCE[key]) + (LATENCY_SLACK_MS if key in LATENCY_KEYS else 0)
+        if value > limit:
+            failures.append(f"{label}: {value} > {limit:.2f} (Baseline {reference})")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulierter Ballabend gegen eine Fake-Telegram-API")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--minutes", type=int, default=15, help="Länge des simulierten Abends")
+    parser.add_argument("--speed", type=int, default=10, help="Beschleunigungsfaktor")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    report = simulate(args.seed, args.minutes, args.speed)
+    print_report(report)
+
+    if args.update_baseline:
+        baseline = {key: value for key, value in report.items() if key not in ("seconds", "timeouts")}
+        for name in BOTS:
+            baseline[name] = {key: value for key, value in report[name].items() if key in TOLERANCE}
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2)
+            file.write("\n")
+        print(f"Baseline gespeichert: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("Keine Baseline vorhanden, kein Vergleich.")
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline["scenario"] != report["scenario"]:
+        print(f"Baseline gilt für {baseline['scenario']}, kein Vergleich.")
+        return 0
+    failures = compare(report, baseline)
+    for failure in failures:
+        print(f"ÜBER BASELINE: {failure}")
+    if not failures:
+        print("Alle Werte innerhalb der Baseline.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())